@@ -13,17 +13,53 @@ bl_info= {
 
 if "bpy" in locals():
     import importlib
+    if "sampling" in locals():
+        importlib.reload(sampling)
+    if "data_source" in locals():
+        importlib.reload(data_source)
+    if "fingerprint" in locals():
+        importlib.reload(fingerprint)
+    if "geometry" in locals():
+        importlib.reload(geometry)
+    if "placement" in locals():
+        importlib.reload(placement)
+    if "spatial" in locals():
+        importlib.reload(spatial)
+    if "paging" in locals():
+        importlib.reload(paging)
+    if "manifest" in locals():
+        importlib.reload(manifest)
+    if "raster" in locals():
+        importlib.reload(raster)
+    if "layering" in locals():
+        importlib.reload(layering)
     if "properties" in locals():
         importlib.reload(properties)
     if "exporter" in locals():
         importlib.reload(exporter)
+    if "live_export" in locals():
+        importlib.reload(live_export)
+    if "sequence" in locals():
+        importlib.reload(sequence)
 
 import bpy
 import logging
   
 from . import (
+    sampling,
+    data_source,
+    fingerprint,
+    geometry,
+    placement,
+    spatial,
+    paging,
+    manifest,
+    raster,
+    layering,
     properties,
     exporter,
+    live_export,
+    sequence,
 )
 
 logger = logging.getLogger("wrapping_paper_tools")
@@ -40,8 +76,12 @@ logger.debug("init logger") # debug, info, warning, error, critical
 def register():
     properties.register()
     exporter.register()
+    live_export.register()
+    sequence.register()
 
 def unregister():
+    sequence.unregister()
+    live_export.unregister()
     properties.unregister()
     exporter.unregister()
 
@@ -0,0 +1,115 @@
+# Headless batch export.
+#
+# Runs the wpt.exporter operator in background-mode Blender for many .blend files:
+#
+#   python batch.py --blender /path/to/blender --jobs 4 --output "{dir}/{stem}.svg" --summary summary.json a.blend b.blend
+#
+# Each .blend file is exported by its own Blender process. Output templates may use
+# {dir}, {stem}, {name} and {index}. Without --output the export path saved in each file is used.
+
+import argparse
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import time
+
+ADDON_MODULE = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+
+BLENDER_SCRIPT = """
+import addon_utils
+import bpy
+addon_utils.enable({module!r}, default_set=False)
+wpt_scene_properties = bpy.context.scene.wpt_scene_properties
+if {output!r}:
+    wpt_scene_properties.export_path = {output!r}
+print("wpt_export_path: " + bpy.path.abspath(wpt_scene_properties.export_path))
+result = bpy.ops.wpt.exporter('EXEC_DEFAULT', force={force!r})
+if 'FINISHED' not in result:
+    raise RuntimeError("wpt.exporter returned " + str(result))
+"""
+
+def format_output(template, blend_path, index):
+    if not template:
+        return ""
+
+    blend_path = os.path.abspath(blend_path)
+    stem = os.path.splitext(os.path.basename(blend_path))[0]
+    return template.format(dir=os.path.dirname(blend_path), stem=stem, name=os.path.basename(blend_path), index=index)
+
+def export_file(blender, blend_path, output, timeout, force=False):
+    script = BLENDER_SCRIPT.format(module=ADDON_MODULE, output=output, force=force)
+    command = [blender, "--background", blend_path, "--python-exit-code", "1", "--python-expr", script]
+
+    start = time.perf_counter()
+    result = {"file": blend_path, "output": output or None, "status": "ok", "returncode": None, "seconds": 0.0, "error": None}
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, timeout=timeout)
+        result["returncode"] = process.returncode
+        for line in process.stdout.splitlines():
+            if line.startswith("wpt_export_path: "):
+                result["output"] = line[len("wpt_export_path: "):]
+        if process.returncode != 0:
+            result["status"] = "failed"
+            result["error"] = "\n".join(process.stdout.splitlines()[-20:])
+    except subprocess.TimeoutExpired:
+        result["status"] = "timeout"
+        result["error"] = "timed out after {0} seconds".format(timeout)
+    except OSError as e:
+        result["status"] = "failed"
+        result["error"] = str(e)
+    result["seconds"] = time.perf_counter() - start
+
+    return result
+
+def run(blender, blend_paths, output_template=None, jobs=1, timeout=None, force=False):
+    start = time.perf_counter()
+    results = [None] * len(blend_paths)
+
+    # 各ファイルは別プロセスの Blender で処理するので、スレッドはプロセスの待ち合わせだけを行う
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {}
+        for index, blend_path in enumerate(blend_paths):
+            output = format_output(output_template, blend_path, index)
+            futures[executor.submit(export_file, blender, blend_path, output, timeout, force)] = index
+
+        for future in concurrent.futures.as_completed(futures):
+            index = futures[future]
+            results[index] = future.result()
+            print("{0}: {1} ({2:.2f}s)".format(results[index]["status"], results[index]["file"], results[index]["seconds"]), file=sys.stderr)
+
+    failed = [result for result in results if result["status"] != "ok"]
+    return {
+        "total": len(results),
+        "succeeded": len(results) - len(failed),
+        "failed": len(failed),
+        "jobs": jobs,
+        "seconds": time.perf_counter() - start,
+        "results": results,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export wrapping paper SVGs from many .blend files in background Blender processes.")
+    parser.add_argument("files", nargs="+", help=".blend files to export")
+    parser.add_argument("--blender", default=os.environ.get("BLENDER", "blender"), help="Blender executable (default: $BLENDER or 'blender')")
+    parser.add_argument("--output", default=None, help="output path template, e.g. '{dir}/{stem}.svg'")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1, help="number of concurrent Blender processes")
+    parser.add_argument("--timeout", type=float, default=None, help="timeout per file in seconds")
+    parser.add_argument("--force", action="store_true", help="export even if the output is up to date")
+    parser.add_argument("--summary", default=None, help="write the JSON summary to this path instead of stdout")
+    args = parser.parse_args(argv)
+
+    summary = run(args.blender, args.files, args.output, args.jobs, args.timeout, args.force)
+
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+    else:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+
+    return 0 if summary["failed"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import bpy
+import csv
+import hashlib
+import io
+import itertools
+import logging
+import numpy
+import os
+
+logger = logging.getLogger("wrapping_paper_tools")
+
+CHUNK_ROWS = 65536
+# 外部ファイルのバイナリ形式。.npy はヘッダ付き、.f32/.bin はリトルエンディアン float32 の行優先配列
+NPY_EXTENSIONS = (".npy",)
+RAW_EXTENSIONS = (".f32", ".bin")
+
+# key: ファイルパスまたはテキスト名, value: (signature, array)
+_cache = {}
+
+def load_circles(path, text_name="circles_data.csv"):
+    # x, y, radius
+    return load_table(path, text_name, 3)
+
+def load_stripes(path, text_name="stripe_data.csv"):
+    # point, r, g, b
+    return load_table(path, text_name, 4)
+
+def get_signature(path, text_name):
+    if path:
+        stat = os.stat(bpy.path.abspath(path))
+        return ("file", stat.st_mtime_ns, stat.st_size)
+
+    # 指紋キャッシュにも使うのでセッションをまたいで安定したハッシュにする
+    return ("text", hashlib.sha1(get_text(text_name).as_string().encode("utf-8")).hexdigest())
+
+def get_text(text_name):
+    text = bpy.data.texts.get(text_name)
+    if text is None:
+        raise ValueError("Text block not found: " + text_name)
+    return text
+
+def get_error_message(error):
+    # 読み込みに失敗したファイルがわかるメッセージ
+    if isinstance(error, OSError) and error.filename:
+        return "Cannot read {0}: {1}".format(error.filename, error.strerror or error)
+    return str(error)
+
+def load_table(path, text_name, columns):
+    key = bpy.path.abspath(path) if path else "text:" + text_name
+    signature = get_signature(path, text_name)
+
+    cached = _cache.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    logger.debug("load: " + key)
+    try:
+        if path:
+            data = read_file(bpy.path.abspath(path), columns)
+        else:
+            data = read_csv(io.StringIO(get_text(text_name).as_string()), columns)
+    except ValueError as error:
+        # numpy の変換エラーにはファイル名が入らない
+        raise ValueError("Cannot read {0}: {1}".format(key, error)) from error
+
+    _cache[key] = (signature, data)
+    return data
+
+def read_file(path, columns):
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension in NPY_EXTENSIONS:
+        data = numpy.load(path, mmap_mode='r')
+        if data.ndim != 2 or data.shape[1] < columns:
+            raise ValueError("expected an array with {0} columns, got shape {1}".format(columns, data.shape))
+        return data[:, :columns]
+
+    if extension in RAW_EXTENSIONS:
+        data = numpy.memmap(path, dtype='<f4', mode='r')
+        if data.size % columns != 0:
+            raise ValueError("size is not a multiple of {0} float32 columns".format(columns))
+        return data.reshape(-1, columns)
+
+    with open(path, newline='') as f:
+        return read_csv(f, columns)
+
+def read_csv(f, columns):
+    # 行をまとめて変換し、巨大なファイルでも一時的なリストが CHUNK_ROWS 行を超えないようにする
+    rows = (row[:columns] for row in csv.reader(f) if row)
+    chunks = []
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK_ROWS))
+        if not chunk:
+            break
+        chunks.append(numpy.array(chunk, dtype=numpy.float64))
+
+    if not chunks:
+        return numpy.empty((0, columns), dtype=numpy.float64)
+
+    return numpy.concatenate(chunks)
+
+def clear_cache():
+    _cache.clear()
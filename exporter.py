@@ -5,15 +5,25 @@ import io
 import logging
 import math
 import mathutils
+import numpy
 import operator
 import random
 import svgwrite
+import xml.etree.ElementTree as etree
+from xml.sax.saxutils import escape
+from . import data_source
+from . import fingerprint
+from . import geometry
+from . import manifest
+from . import paging
+from . import raster
+from . import spatial
+from . placement import Placements
+from . sampling import CollectionPicker
 
 logger = logging.getLogger("wrapping_paper_tools")
 
-class SvgExporter(bpy.types.Operator):
-    bl_idname = "wpt.exporter"
-    bl_label = "Export Wrapping Paper"
+class WrappingPaperMixin():
     location_matrix = mathutils.Matrix((
         [1.0, 0.0, 0.0],
         [0.0, -1.0, 0.0],
@@ -26,18 +36,25 @@ class SvgExporter(bpy.types.Operator):
         self.objs = []
         self.points = []
         self.points_c = []
+        # Circle packing の (n, 3) の配列 x, y, radius
+        self.circles = None
+        self.point_cells = []
+        self.placements = Placements()
+        self.paths = {}
+        # コレクション名 -> 出力する <g> の id。指定がなければコレクション名
+        self.ids = {}
+        self.instance_elements = []
         self.uses = []
         self.duplicate_objs = []
+        self.markers = None
+        self.neighbor_conflicts = 0
 
         self.scale = 0.0
 
         logger.info("end")
 
-    def invoke(self, context, event):
-        logger.info("start")
-
+    def create_drawing(self, context, export_path):
         wpt_scene_properties = context.scene.wpt_scene_properties
-        export_path = bpy.path.abspath(wpt_scene_properties.export_path)
         width = wpt_scene_properties.width
         height = wpt_scene_properties.height
         self.scale = wpt_scene_properties.scale
@@ -54,29 +71,13 @@ class SvgExporter(bpy.types.Operator):
         if wpt_scene_properties.use_stripe_background:
             self.add_stripe(width, height)
 
-        self.get_objects()
-        self.add_defs()
-        self.create_points(width, height)
-        self.create_uses()
-
-        logger.debug("save: start")
-        self.svg.save()
-        logger.debug("save: end")
-
-        logger.info("end")
-
-        return {'FINISHED'}
-
     def add_stripe(self, width, height):
-        for row in bpy.data.texts["stripe_data.csv"].lines:
-            if not row.body:
-                continue
-
-            point, r, g, b = row.body.split(',')
+        stripe_data = data_source.load_stripes(bpy.context.scene.wpt_scene_properties.stripe_data_path)
+        for point, r, g, b in stripe_data.tolist():
             # logger.debug("point: " + str(point))
 
-            svg_color = svgwrite.rgb(float(r),float(g),float(b))
-            rect = self.svg.rect(insert=(float(point), -height/2.0), size=('100%', '100%'), rx=None, ry=None, fill=svg_color, opacity=1.0)
+            svg_color = svgwrite.rgb(r,g,b)
+            rect = self.svg.rect(insert=(point, -height/2.0), size=('100%', '100%'), rx=None, ry=None, fill=svg_color, opacity=1.0)
             self.svg.add(rect)
 
     def get_objects(self):
@@ -115,25 +116,49 @@ class SvgExporter(bpy.types.Operator):
             self.objs.append(obj)
 
     def add_defs(self):
-        for collection in self.collections:
-            svg_group = self.svg.g(id=collection.name)
+        # Flattened ではインスタンスごとにパスを書き出すので defs は不要
+        # Proof では配置が決まってから画像の defs を作る
+        use_defs = bpy.context.scene.wpt_scene_properties.export_mode == "0"
 
-            # z位置が小さい順にsvgを定義していく
-            for obj in sorted(collection.objects, key=lambda obj: obj.location.z):
-                self.add_curve_data(obj, svg_group)
+        for collection in self.collections:
+            svg_group = self.create_group(collection, use_defs)
 
-            self.svg.defs.add(svg_group)
+            if use_defs:
+                self.svg.defs.add(svg_group)
 
             logger.debug("add group: " + collection.name)
 
-    def add_curve_data(self, obj, group):
+    def create_group(self, collection, use_defs=True):
+        svg_group = self.svg.g(id=self.get_id(collection)) if use_defs else None
+        paths = []
+
+        # z位置が小さい順にsvgを定義していく
+        for obj in sorted(collection.objects, key=lambda obj: obj.location.z):
+            self.add_curve_data(obj, svg_group, paths)
+
+        self.paths[collection.name] = paths
+
+        return svg_group
+
+    def get_id(self, collection):
+        return self.ids.get(collection.name, collection.name)
+
+    def add_curve_data(self, obj, group, paths):
         # logger.debug("add path: " + str(obj.name))
         color, alpha = self.get_diffuse_color(obj)
         curve = obj.data
         matrix_world = obj.matrix_world
         scale = bpy.context.scene.wpt_scene_properties.scale
 
-        for spline in curve.splines:
+        wpt_scene_properties = bpy.context.scene.wpt_scene_properties
+        tolerance = 0.0
+        if wpt_scene_properties.use_simplify:
+            tolerance = wpt_scene_properties.simplify_tolerance
+        flatness = 0.0
+        if wpt_scene_properties.use_adaptive_resolution:
+            flatness = wpt_scene_properties.flatness
+
+        for spline_index, spline in enumerate(curve.splines):
             if spline.type != 'BEZIER':
                 logger.info("Spline type is not BEZIER")
                 continue
@@ -141,7 +166,11 @@ class SvgExporter(bpy.types.Operator):
             # ループしているかの判定。使うかどうか検討中。
             is_loop = spline.use_cyclic_u
 
-            svg_path = SVGPath(spline, matrix_world, scale)
+            svg_path = SVGPath(spline, matrix_world, scale, color, alpha, tolerance, (curve.name, spline_index), wpt_scene_properties.use_polyline, curve.resolution_u, flatness)
+            paths.append(svg_path)
+
+            if group is None:
+                continue
 
             # self.svg.add(self.svg.path(d=svg_path.d, fill=color, opacity=alpha, stroke=color))
             group.add(self.svg.path(d=svg_path.d, fill=color, opacity=alpha, stroke=color))
@@ -167,6 +196,11 @@ class SvgExporter(bpy.types.Operator):
         noise_x = 0
         noise_y = 0
 
+        # 間隔を保つノイズは格子点をすべて求めてからまとめて加える
+        use_clearance_noise = use_location_noise and wpt_scene_properties.use_clearance_noise and (pattern == "0" or pattern == "1")
+        if use_clearance_noise:
+            use_location_noise = False
+
         if pattern == "0": # Square lattice
             distance_x = wpt_scene_properties.distance_x
             distance_y = wpt_scene_properties.distance_y
@@ -180,6 +214,7 @@ class SvgExporter(bpy.types.Operator):
                         noise_y = random.uniform(-noise_limit, noise_limit)
                     point = mathutils.Vector((x * distance_x + noise_x, y * distance_y + noise_y))
                     self.points.append(point)
+                    self.point_cells.append((x, y))
 
         elif pattern == "1": # Hexagonal lattice
             distance_x = wpt_scene_properties.distance_x
@@ -197,6 +232,7 @@ class SvgExporter(bpy.types.Operator):
                             noise_y = random.uniform(-noise_limit, noise_limit)
                         point = mathutils.Vector((x * distance_x + noise_x, y * distance_y + noise_y))
                         self.points.append(point)
+                        self.point_cells.append((x, y))
                 else:
                     for x in range(-count_x - 1, count_x + 1, 1):
                         if use_location_noise:
@@ -204,6 +240,7 @@ class SvgExporter(bpy.types.Operator):
                             noise_y = random.uniform(-noise_limit, noise_limit)
                         point = mathutils.Vector(((x + 1/2) * distance_x  + noise_x, y * distance_y + noise_y))
                         self.points.append(point)
+                        self.point_cells.append((x, y))
 
         elif pattern == "2": # Yagasuri
             scale = wpt_scene_properties.scale
@@ -227,14 +264,36 @@ class SvgExporter(bpy.types.Operator):
                     self.points_c.append(SVGPoint(point,1))
 
         elif pattern == "3": # Circle packing
-            # with open('circles_data.csv', 'r') as f:
-                # reader = csv.reader(f)
-            for row in bpy.data.texts["circles_data.csv"].lines:
-                if not row.body:
-                    continue
+            # 行数が多いので点のオブジェクトは作らず、配列のまま create_placements で使う
+            self.circles = data_source.load_circles(wpt_scene_properties.circles_data_path)
 
-                row_array = row.body.split(',')
-                self.points.append(SVGPoint(mathutils.Vector((float(row_array[0]), float(row_array[1]))), radius=float(row_array[2])))
+        if use_clearance_noise:
+            self.add_clearance_noise(noise_limit, wpt_scene_properties.clearance, wpt_scene_properties.use_rotation_noise)
+
+    def add_clearance_noise(self, noise_limit, clearance, use_rotation_noise):
+        # どのコレクションが置かれても間隔を保てるよう、最大の外接矩形で判定する
+        half_x = 0.0
+        half_y = 0.0
+        for collection in self.collections:
+            svg_paths = self.paths[collection.name]
+            if not svg_paths:
+                continue
+
+            box_min, box_max = geometry.bounds(numpy.concatenate([svg_path.points for svg_path in svg_paths]))
+            extent = numpy.maximum(numpy.abs(box_min), numpy.abs(box_max))
+            if use_rotation_noise:
+                # 回転しても外接円に収まる
+                radius = float(numpy.hypot(extent[0], extent[1]))
+                half_x = max(half_x, radius)
+                half_y = max(half_y, radius)
+            else:
+                half_x = max(half_x, float(extent[0]))
+                half_y = max(half_y, float(extent[1]))
+
+        positions = spatial.jitter_with_clearance([(point.x, point.y) for point in self.points], (half_x, half_y), clearance, noise_limit)
+        for point, (x, y) in zip(self.points, positions):
+            point.x = x
+            point.y = y
 
     def create_uses(self):
         logger.info("start")
@@ -242,109 +301,470 @@ class SvgExporter(bpy.types.Operator):
         if len(self.collections) <= 0:
             return
 
+        self.create_placements()
+
+        wpt_scene_properties = bpy.context.scene.wpt_scene_properties
+        if wpt_scene_properties.export_mode == "2": # Proof
+            self.add_proof_defs()
+
+        if wpt_scene_properties.export_mode == "1": # Flattened
+            self.add_flattened()
+        elif wpt_scene_properties.use_matrix_transform:
+            self.add_matrix_uses()
+        else:
+            self.add_uses()
+
+        logger.info("end")
+
+    def create_placements(self):
         wpt_scene_properties = bpy.context.scene.wpt_scene_properties
         use_rotation_noise = wpt_scene_properties.use_rotation_noise
         noise_limit_degrees = wpt_scene_properties.rotation_noise
 
         pattern = wpt_scene_properties.pattern_type
         if pattern == "0" or pattern == "1": # Square lattice, Hexagonal lattice
-            for point in self.points:
-                collection = random.choice(self.collections)
-
-                use = self.svg.use(self.svg.symbol(id=collection.name), insert=(point.x, -point.y), size=(100,100))
+            weights = [collection.wpt_collection_properties.weight for collection in self.collections]
+            picker = CollectionPicker(weights, pattern, wpt_scene_properties.avoid_same_neighbors)
+            for point, cell in zip(self.points, self.point_cells):
+                collection_index = picker.pick(cell)
 
+                rotation = 0.0
                 if use_rotation_noise:
                     noise_rotation_degrees = random.uniform(-noise_limit_degrees, noise_limit_degrees)
-                    use.rotate(angle = math.degrees(noise_rotation_degrees), center = (point.x, -point.y))
+                    rotation = math.degrees(noise_rotation_degrees)
 
-                self.svg.add(use)
+                self.placements.append(collection_index, point.x, -point.y, rotation)
+
+            # 隣接の重複が残ったら格子の塗り分けで直す
+            changed_cells = picker.repair()
+            for position, cell in enumerate(self.point_cells):
+                if cell in changed_cells:
+                    self.placements.collection[position] = changed_cells[cell]
+            self.neighbor_conflicts = picker.conflict_count() if wpt_scene_properties.avoid_same_neighbors else 0
+            if self.neighbor_conflicts > 0:
+                logger.warning("{0} neighbor pairs share a collection".format(self.neighbor_conflicts))
 
         elif pattern == "2":
             for point in self.points_c:
-                collection = self.collections[point.collection]
+                self.placements.append(point.collection, point.location.x, -point.location.y, point.rotate)
 
-                use = self.svg.use(self.svg.symbol(id=collection.name), insert=(point.location.x, -point.location.y), size=(100,100))
+        elif pattern == "3": # Circle packing
+            logger.info("start create placements for Circle packing")
+            collection_index_offset = wpt_scene_properties.collection_index_offset
+            circles = self.circles
+            count = len(circles)
 
-                if point.rotate != 0:
-                    use.rotate(angle = point.rotate, center = (point.location.x, -point.location.y))
+            collection = (numpy.arange(count) + collection_index_offset) % len(self.collections)
+            scale = circles[:, 2].astype(numpy.float64) * self.scale * 0.0001
 
-                self.svg.add(use)
+            rotation = numpy.zeros(count, dtype=numpy.float64)
+            if use_rotation_noise:
+                # 1件ずつ random.uniform を呼んでいたときと同じ乱数列にする
+                rotation = numpy.degrees([random.uniform(-noise_limit_degrees, noise_limit_degrees) for index in range(count)])
 
-        elif pattern == "3": # Circle packing
-            logger.info("start create uses for Circle packing")
-            transform_tmpl = "scale({0},{1}) translate({2},{3})"
-            collection_index_offset = wpt_scene_properties.collection_index_offset
-            for index, point in enumerate(self.points):
-                collection = self.collections[(index + collection_index_offset) % len(self.collections)]
+            self.placements.set_columns(collection, circles[:, 0], -circles[:, 1].astype(numpy.float64), rotation, scale)
+
+            logger.info("end create placements for Circle packing")
+
+        self.placements.finalize()
+
+    def add_proof_defs(self):
+        # コレクションごとに一度だけラスタライズした画像を defs に置く。配置は通常の出力と同じ
+        logger.info("start")
+        wpt_scene_properties = bpy.context.scene.wpt_scene_properties
+
+        # 最も大きく配置されるインスタンスで画素が粗くならない解像度にする
+        max_scale = float(self.placements.scale.max()) if len(self.placements) > 0 else 1.0
+        density = wpt_scene_properties.proof_density * max(max_scale, 1e-6)
+
+        for collection in self.collections:
+            svg_group = self.svg.g(id=self.get_id(collection))
 
-                # logger.info(point.radius)
+            proof = raster.rasterize_cached(collection.name, self.paths[collection.name], density)
+            if proof is not None:
+                href, insert, size = proof
+                image = self.svg.image(href, insert=insert, size=size)
+                image.stretch()
+                svg_group.add(image)
 
-                scale = point.radius * self.scale * 0.0001
-                translate_x = -point.location.x * (1 - 1/scale)
-                translate_y = point.location.y * (1 - 1/scale)
+            self.svg.defs.add(svg_group)
+
+        logger.info("end")
+
+    def add_uses(self):
+        pattern = bpy.context.scene.wpt_scene_properties.pattern_type
+        transform_tmpl = "scale({0},{1}) translate({2},{3})"
+        placements = self.placements
+
+        for collection_index, x, y, rotation, scale in zip(placements.collection.tolist(), placements.x.tolist(), placements.y.tolist(), placements.rotation.tolist(), placements.scale.tolist()):
+            collection = self.collections[collection_index]
+
+            if pattern == "3": # Circle packing
+                translate_x = -x * (1 - 1/scale)
+                translate_y = -y * (1 - 1/scale)
                 transform = transform_tmpl.format(scale,scale,translate_x,translate_y)
-                use = self.svg.use(self.svg.symbol(id=collection.name), insert=(point.location.x, -point.location.y), transform=transform)
+                use = self.svg.use(self.svg.symbol(id=self.get_id(collection)), insert=(x, y), transform=transform)
+            else:
+                use = self.svg.use(self.svg.symbol(id=self.get_id(collection)), insert=(x, y), size=(100,100))
 
-                if use_rotation_noise:
-                    noise_rotation_degrees = random.uniform(-noise_limit_degrees, noise_limit_degrees)
-                    use.rotate(angle = math.degrees(noise_rotation_degrees), center = (point.location.x, -point.location.y))
+            if rotation != 0:
+                use.rotate(angle = rotation, center = (x, y))
 
-                self.svg.add(use)
+            self.svg.add(use)
+            self.instance_elements.append((use,))
 
-            logger.info("end create uses for Circle packing")
+    def add_matrix_uses(self):
+        # 配置をまとめて matrix(a,b,c,d,e,f) に変換し、コレクションごとに一度だけ作った href を使い回す
+        batch = SVGUseBatch(["#" + self.get_id(collection) for collection in self.collections], self.placements)
+        self.svg.add(batch)
+        self.instance_elements = batch
 
-class SVGPath():
-    svg_matrix = mathutils.Matrix((
-        [1.0, 0.0, 0.0, 0.0],
-        [0.0, -1.0, 0.0, 0.0],
-        [0.0, 0.0, 1.0, 0.0],
-        [0.0, 0.0, 0.0, 1.0]))
+    def get_instance_bounds(self):
+        collection_bounds = []
+        for collection in self.collections:
+            svg_paths = self.paths[collection.name]
+            if svg_paths:
+                collection_bounds.append(geometry.bounds(numpy.concatenate([svg_path.points for svg_path in svg_paths])))
+            else:
+                collection_bounds.append(None)
 
-    def __init__(self, spline, matrix_world, scale):
-        self.spline = spline
-        self.matrix_world = matrix_world
-        self.scale = scale
-        self.ds = []
+        return spatial.instance_bounds(self.placements, collection_bounds)
+
+    def check_instances(self, clearance):
+        logger.info("start")
+
+        mins, maxs = self.get_instance_bounds()
+        i, j, gap = spatial.find_close_pairs(mins, maxs, clearance)
+
+        overlap = gap < 0.0
+        overlaps = list(zip(i[overlap].tolist(), j[overlap].tolist(), gap[overlap].tolist()))
+        too_close = list(zip(i[~overlap].tolist(), j[~overlap].tolist(), gap[~overlap].tolist()))
 
-        self.append_move_to()
-        self.append_bezier_curve()
-        self.append_end()
+        logger.info("end")
+
+        return overlaps, too_close
+
+    def add_clearance_markers(self, report):
+        overlaps, too_close = report
+        mins, maxs = self.get_instance_bounds()
+        group = self.svg.g(id="wpt_clearance_markers", fill="none", stroke_width=2)
+
+        # 重なりは赤、間隔不足は橙で外接矩形を描く
+        marked = set()
+        for pairs, color in ((overlaps, "red"), (too_close, "orange")):
+            for i, j, gap in pairs:
+                for index in (i, j):
+                    if index in marked:
+                        continue
+                    marked.add(index)
+                    size = maxs[index] - mins[index]
+                    group.add(self.svg.rect(insert=(mins[index][0], mins[index][1]), size=(size[0], size[1]), stroke=color))
+
+        self.svg.add(group)
+        self.markers = group
+
+    def add_flattened(self):
+        # <use> を使わず、各インスタンスの変換をコレクションの制御点へ直接適用してパスとして書き出す
+        logger.info("start")
+        placements = self.placements
+        instance_paths = [None] * len(placements)
+
+        for collection_index, collection in enumerate(self.collections):
+            svg_paths = self.paths[collection.name]
+            if not svg_paths:
+                continue
+
+            indices = numpy.nonzero(placements.collection == collection_index)[0]
+            if len(indices) <= 0:
+                continue
+
+            points = numpy.concatenate([svg_path.points for svg_path in svg_paths]).astype(numpy.float64)
+            offsets = numpy.cumsum([0] + [len(svg_path.points) for svg_path in svg_paths]).tolist()
+            templates = [svg_path.template for svg_path in svg_paths]
+            styles = [(svg_path.color, str(svg_path.alpha), svg_path.color) for svg_path in svg_paths]
+
+            for start, transformed in geometry.iter_transformed(points, placements.matrices(indices)):
+                for index, instance_points in zip(indices[start:start + len(transformed)].tolist(), transformed.reshape(len(transformed), -1).tolist()):
+                    instance_paths[index] = [(template.format(*instance_points[begin * 2:end * 2]), style) for template, style, begin, end in zip(templates, styles, offsets, offsets[1:])]
+
+        # インスタンスの重なり順は <use> の場合と同じにする
+        batch = SVGPathBatch(instance_paths)
+        self.svg.add(batch)
+        self.instance_elements = batch
+
+        logger.info("end")
+
+    def get_instance_markup(self):
+        # インスタンスごとのマークアップ文字列
+        if isinstance(self.instance_elements, (SVGUseBatch, SVGPathBatch)):
+            return self.instance_elements.markup()
+        return [''.join(element.tostring() for element in elements) for elements in self.instance_elements]
+
+    def get_background_markup(self):
+        # create_drawing で追加した背景と縞模様
+        return ''.join(element.tostring() for element in self.svg.elements if element is not self.svg.defs)
+
+    def get_page_background(self, page_min, page_max):
+        # ページごとの背景。シート全体用の背景は '100%' 指定なのでページの範囲に合わせて作り直す
+        wpt_scene_properties = bpy.context.scene.wpt_scene_properties
+        size = (page_max[0] - page_min[0], page_max[1] - page_min[1])
+        elements = []
+
+        if wpt_scene_properties.use_background:
+            background_color = wpt_scene_properties.background_color
+            elements.append(self.svg.rect(insert=page_min, size=size, fill=self.get_color(background_color), opacity=background_color[3]))
+
+        if wpt_scene_properties.use_stripe_background:
+            stripe_data = data_source.load_stripes(wpt_scene_properties.stripe_data_path)
+            for point, r, g, b in stripe_data.tolist():
+                if point >= page_max[0]:
+                    continue
+                x = max(point, page_min[0])
+                elements.append(self.svg.rect(insert=(x, page_min[1]), size=(page_max[0] - x, size[1]), fill=svgwrite.rgb(r,g,b), opacity=1.0))
+
+        return ''.join(element.tostring() for element in elements)
+
+    def save_pages(self, export_path):
+        logger.info("start")
+        wpt_scene_properties = bpy.context.scene.wpt_scene_properties
+
+        pages = paging.page_boxes(wpt_scene_properties.width, wpt_scene_properties.height, wpt_scene_properties.page_width, wpt_scene_properties.page_height, wpt_scene_properties.page_overlap)
+        bleed = wpt_scene_properties.page_bleed
 
-        self.d = ' '.join(self.ds)
+        defs = self.svg.defs.tostring() if self.svg.defs.elements else ""
+        instances = self.get_instance_markup()
+        # マーカーはページの外にはみ出した分が表示されないだけなので、全ページに同じものを置く
+        markers = self.markers.tostring() if self.markers is not None else ""
 
-    def append_move_to(self):
-        m = self.get_global_pos(self.spline.bezier_points[0].co)
-        self.ds.append("M{0},{1}".format(m.x, m.y))
+        grid = None
+        if len(instances) > 0:
+            mins, maxs = self.get_instance_bounds()
+            grid = spatial.UniformGrid(mins, maxs)
 
-    def append_bezier_curve(self):
-        for i in range(len(self.spline.bezier_points) - 1):
-            p1 = self.spline.bezier_points[i]
-            p2 = self.spline.bezier_points[i + 1]
+        jobs = []
+        for row, column, page_min, page_max in pages:
+            page_min = (page_min[0] - bleed, page_min[1] - bleed)
+            page_max = (page_max[0] + bleed, page_max[1] + bleed)
 
-            c1 = self.get_global_pos(p1.handle_right)
-            c2 = self.get_global_pos(p2.handle_left)
-            c = self.get_global_pos(p2.co)
+            hits = []
+            if grid is not None:
+                # 元の重なり順を保つため番号順に並べる
+                hits = numpy.sort(grid.query(page_min, page_max)).tolist()
 
-            self.ds.append("C {0},{1} {2},{3} {4},{5}".format(c1.x, c1.y, c2.x, c2.y, c.x, c.y))
+            parts = [defs, self.get_page_background(page_min, page_max)]
+            parts.extend(instances[index] for index in hits)
+            parts.append(markers)
+            jobs.append((paging.page_path(export_path, row, column), page_min, page_max, parts))
 
-    def append_end(self):
-        start_point = self.spline.bezier_points[0]
-        end_point = self.spline.bezier_points[-1]
+        paths = paging.write_pages(jobs)
 
-        c1 = self.get_global_pos(end_point.handle_right)
-        c2 = self.get_global_pos(start_point.handle_left)
-        c = self.get_global_pos(start_point.co)
+        logger.info("end: {0} pages".format(len(paths)))
+        return paths
 
-        self.ds.append("C {0},{1} {2},{3} {4},{5}".format(c1.x, c1.y, c2.x, c2.y, c.x, c.y))
+class SvgExporter(WrappingPaperMixin, bpy.types.Operator):
+    bl_idname = "wpt.exporter"
+    bl_label = "Export Wrapping Paper"
+
+    force: bpy.props.BoolProperty(name="Force", description="Export even if nothing changed since the last export", default=False, options={'SKIP_SAVE'})
+
+    def invoke(self, context, event):
+        return self.execute(context)
+
+    def execute(self, context):
+        try:
+            return self.export(context)
+        except (OSError, ValueError) as error:
+            # 外部データが見つからない、読めない場合
+            message = data_source.get_error_message(error)
+            logger.error(message)
+            self.report({'ERROR'}, message)
+            return {'CANCELLED'}
+
+    def export(self, context):
+        logger.info("start")
+
+        wpt_scene_properties = context.scene.wpt_scene_properties
+        export_path = bpy.path.abspath(wpt_scene_properties.export_path)
 
-    def get_global_pos(self, vec):
-        v = vec.copy()
-        v.resize_4d()
+        if wpt_scene_properties.use_pages and wpt_scene_properties.page_overlap * 2 > min(wpt_scene_properties.page_width, wpt_scene_properties.page_height):
+            # ページが進まず、ほぼ1ピクセルごとにページができてしまう
+            self.report({'ERROR'}, "Page overlap must be at most half the page size")
+            return {'CANCELLED'}
 
-        w = self.svg_matrix @ v
-        w = w * self.scale
-        w.resize_3d()
-        return w
+        self.get_objects()
+
+        export_fingerprint = fingerprint.compute(context.scene, self.collections)
+        if not self.force and fingerprint.is_up_to_date(export_path, export_fingerprint):
+            logger.info("skip: nothing changed")
+            self.report({'INFO'}, "Nothing changed since the last export")
+            return {'FINISHED'}
+
+        self.create_drawing(context, export_path)
+        self.add_defs()
+        self.create_points(wpt_scene_properties.width, wpt_scene_properties.height)
+        self.create_uses()
+
+        if self.neighbor_conflicts > 0:
+            self.report({'WARNING'}, "{0} neighboring instances share a collection: not enough collections to avoid it".format(self.neighbor_conflicts))
+
+        if wpt_scene_properties.use_clearance_markers and len(self.placements) > 0:
+            self.add_clearance_markers(self.check_instances(wpt_scene_properties.clearance))
+
+        if wpt_scene_properties.use_pages:
+            # ページ分割ではシート全体のファイルを書き出さないので指紋も記録しない
+            paths = self.save_pages(export_path)
+            self.report({'INFO'}, "{0} pages exported".format(len(paths)))
+        else:
+            logger.debug("save: start")
+            self.svg.save()
+            fingerprint.record(export_path, export_fingerprint)
+            logger.debug("save: end")
+
+        if wpt_scene_properties.use_manifest and len(self.collections) > 0:
+            manifest.write(export_path, self.placements, [collection.name for collection in self.collections], wpt_scene_properties.random_seed)
+
+        logger.info("end")
+
+        return {'FINISHED'}
+
+class CheckInstances(WrappingPaperMixin, bpy.types.Operator):
+    bl_idname = "wpt.check_instances"
+    bl_label = "Check Overlaps"
+    bl_description = "Find instances that overlap or are closer than the clearance"
+
+    def invoke(self, context, event):
+        return self.execute(context)
+
+    def execute(self, context):
+        try:
+            return self.check_scene(context)
+        except (OSError, ValueError) as error:
+            # 外部データが見つからない、読めない場合
+            message = data_source.get_error_message(error)
+            logger.error(message)
+            self.report({'ERROR'}, message)
+            return {'CANCELLED'}
+
+    def check_scene(self, context):
+        logger.info("start")
+
+        wpt_scene_properties = context.scene.wpt_scene_properties
+
+        self.get_objects()
+        self.create_drawing(context, None)
+        self.add_defs()
+        self.create_points(wpt_scene_properties.width, wpt_scene_properties.height)
+
+        overlaps = []
+        too_close = []
+        if len(self.collections) > 0:
+            self.create_placements()
+            overlaps, too_close = self.check_instances(wpt_scene_properties.clearance)
+
+        wpt_scene_properties.overlap_count = len(overlaps)
+        wpt_scene_properties.clearance_count = len(too_close)
+
+        for i, j, gap in too_close[:10]:
+            logger.info("too close: {0} {1} gap={2:.3f}".format(i, j, gap))
+        for i, j, gap in overlaps[:10]:
+            logger.info("overlap: {0} {1}".format(i, j))
+
+        self.report({'INFO'}, "{0} instances, {1} overlaps, {2} too close".format(len(self.placements), len(overlaps), len(too_close)))
+
+        logger.info("end")
+
+        return {'FINISHED'}
+
+class SVGPath():
+    def __init__(self, spline, matrix_world, scale, color=None, alpha=1.0, tolerance=0.0, key=None, polyline=False, resolution=12, flatness=0.0):
+        self.spline = spline
+        self.matrix_world = matrix_world
+        self.scale = scale
+        self.color = color
+        self.alpha = alpha
+        self.polyline = polyline
+
+        self.points = geometry.spline_points(spline, scale)
+        if tolerance > 0.0:
+            self.points = geometry.simplify_cached(key, self.points, tolerance)
+
+        if polyline:
+            self.points = geometry.flatten(self.points, resolution, flatness)
+            self.template = geometry.polyline_template(len(self.points))
+        else:
+            self.template = geometry.path_template((len(self.points) - 1) // 3)
+
+        self.d = self.template.format(*self.points.ravel().tolist())
+
+class SVGUseBatch():
+    # 全インスタンスの <use> をまとめて出力する要素。インスタンスごとに svgwrite の要素を作らない
+    elementname = 'g'
+    use_template = '<use transform="matrix({},{},{},{},{},{})" xlink:href="{}" />'
+
+    def __init__(self, hrefs, placements):
+        self.hrefs = hrefs
+        self.collection = placements.collection
+        matrices = placements.matrices()
+        # a, b, c, d, e, f の順に並べる。丸めて 1e-16 のような誤差を消し、+ 0.0 で -0.0 を 0.0 にそろえる
+        values = numpy.stack((matrices[:, 0, 0], matrices[:, 1, 0], matrices[:, 0, 1], matrices[:, 1, 1], matrices[:, 0, 2], matrices[:, 1, 2]), axis=1)
+        self.values = numpy.round(values, 9) + 0.0
+
+    def __len__(self):
+        return len(self.values)
+
+    def iter_attributes(self):
+        transform_tmpl = "matrix({},{},{},{},{},{})"
+        for collection_index, values in zip(self.collection.tolist(), self.values.tolist()):
+            yield transform_tmpl.format(*values), self.hrefs[collection_index]
+
+    def get_xml(self):
+        group = etree.Element('g')
+        for transform, href in self.iter_attributes():
+            etree.SubElement(group, 'use', {'transform': transform, 'xlink:href': href})
+        return group
+
+    def tostring(self):
+        return etree.tostring(self.get_xml(), encoding='unicode')
+
+    def markup(self):
+        hrefs = [escape(href, {'"': '&quot;'}) for href in self.hrefs]
+        return [self.use_template.format(*values, hrefs[collection_index]) for collection_index, values in zip(self.collection.tolist(), self.values.tolist())]
+
+class SVGPathBatch():
+    # Flattened の全インスタンスのパスをまとめて出力する要素。パスごとに svgwrite の要素を作らない
+    elementname = 'g'
+    path_template = '<path d="{}" fill="{}" opacity="{}" stroke="{}" />'
+
+    def __init__(self, instance_paths):
+        # instance_paths[i] はインスタンス i の (d, (fill, opacity, stroke)) のリスト。パスのないインスタンスは None
+        self.instance_paths = [paths or [] for paths in instance_paths]
+
+    def __len__(self):
+        return len(self.instance_paths)
+
+    def get_xml(self):
+        group = etree.Element('g')
+        for paths in self.instance_paths:
+            for d, (fill, opacity, stroke) in paths:
+                etree.SubElement(group, 'path', {'d': d, 'fill': fill, 'opacity': opacity, 'stroke': stroke})
+        return group
+
+    def tostring(self):
+        return etree.tostring(self.get_xml(), encoding='unicode')
+
+    def markup(self):
+        entities = {'"': '&quot;'}
+        styles = {}
+        result = []
+        for paths in self.instance_paths:
+            parts = []
+            for d, style in paths:
+                escaped = styles.get(id(style))
+                if escaped is None:
+                    escaped = styles[id(style)] = [escape(value, entities) for value in style]
+                parts.append(self.path_template.format(escape(d, entities), *escaped))
+            result.append(''.join(parts))
+        return result
 
 class SVGUse():
     def __init__(self, id, location):
@@ -365,6 +785,7 @@ class SVGPoint():
 
 classes = (
     SvgExporter,
+    CheckInstances,
 )
 
 def register():
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import numpy
+import os
+from . import data_source
+
+# 出力内容に影響する変更を exporter に加えたら上げる
+FINGERPRINT_VERSION = 1
+# 出力に影響しない UI 用のプロパティ
+IGNORED_SCENE_PROPERTIES = {"rna_type", "script_is_executed", "lock_init_project", "draw_area", "slide", "slide_sub", "overlap_count", "clearance_count",
+    "use_live_export", "live_export_delay", "sequence_format"}
+
+def compute(scene, collections):
+    h = hashlib.sha256()
+    h.update(str(FINGERPRINT_VERSION).encode())
+
+    update_properties(h, scene.wpt_scene_properties, IGNORED_SCENE_PROPERTIES)
+
+    for collection in collections:
+        h.update(b"collection:" + collection.name.encode("utf-8"))
+        update_properties(h, collection.wpt_collection_properties, {"rna_type"})
+        for obj in sorted(collection.objects, key=lambda obj: obj.name):
+            update_object(h, obj)
+
+    wpt_scene_properties = scene.wpt_scene_properties
+    if wpt_scene_properties.use_stripe_background:
+        h.update(repr(data_source.get_signature(wpt_scene_properties.stripe_data_path, "stripe_data.csv")).encode())
+    if wpt_scene_properties.pattern_type == "3": # Circle packing
+        h.update(repr(data_source.get_signature(wpt_scene_properties.circles_data_path, "circles_data.csv")).encode())
+
+    return h.hexdigest()
+
+def update_properties(h, properties, ignored):
+    for prop in properties.bl_rna.properties:
+        if prop.identifier in ignored:
+            continue
+
+        value = getattr(properties, prop.identifier)
+        if getattr(prop, "is_array", False):
+            value = tuple(value)
+        h.update("{0}={1!r};".format(prop.identifier, value).encode("utf-8"))
+
+def update_object(h, obj):
+    h.update("object:{0}:{1}:{2!r}".format(obj.name, obj.type, [tuple(row) for row in obj.matrix_world]).encode("utf-8"))
+
+    if obj.type != 'CURVE':
+        return
+
+    curve = obj.data
+    h.update("curve:{0}:{1}:{2}".format(curve.name, curve.dimensions, curve.resolution_u).encode("utf-8"))
+
+    for material in curve.materials:
+        if material is None:
+            h.update(b"material:None")
+            continue
+        h.update("material:{0}:{1!r}".format(material.name, tuple(material.diffuse_color)).encode("utf-8"))
+
+    for spline in curve.splines:
+        h.update("spline:{0}:{1}".format(spline.type, spline.use_cyclic_u).encode())
+        bezier_points = spline.bezier_points
+        buffer = numpy.empty(len(bezier_points) * 3, dtype=numpy.float32)
+        for attribute in ("co", "handle_left", "handle_right"):
+            bezier_points.foreach_get(attribute, buffer)
+            h.update(buffer.tobytes())
+
+def get_record_path(export_path):
+    return export_path + ".fingerprint"
+
+def is_up_to_date(export_path, fingerprint):
+    record_path = get_record_path(export_path)
+    if not os.path.exists(export_path) or not os.path.exists(record_path):
+        return False
+
+    try:
+        with open(record_path) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    # 出力ファイルが外部で書き換えられていたら再出力する
+    stat = os.stat(export_path)
+    return record.get("fingerprint") == fingerprint and record.get("size") == stat.st_size and record.get("mtime_ns") == stat.st_mtime_ns
+
+def record(export_path, fingerprint):
+    stat = os.stat(export_path)
+    with open(get_record_path(export_path), "w") as f:
+        json.dump({"fingerprint": fingerprint, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}, f)
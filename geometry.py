@@ -0,0 +1,252 @@
+import hashlib
+import math
+import numpy
+
+# Blender の座標(上が +Y)から SVG の座標(下が +Y)への変換
+SVG_FLIP = numpy.array((1.0, -1.0), dtype=numpy.float32)
+# 一度に変換する制御点数の上限。これを超えるとインスタンスを分割して変換する
+TRANSFORM_CHUNK_POINTS = 1 << 20
+
+# key: (カーブ名, スプライン番号), value: (signature, 簡略化した制御点列)
+_simplify_cache = {}
+
+def spline_points(spline, scale):
+    # 閉じた3次ベジエの制御点列 [P0, R0, L1, P1, R1, L2, P2, ..., P(n-1), R(n-1), L0, P0] を (3n+1, 2) の配列で返す
+    bezier_points = spline.bezier_points
+    n = len(bezier_points)
+
+    buffer = numpy.empty(n * 3, dtype=numpy.float32)
+    bezier_points.foreach_get("co", buffer)
+    co = buffer.reshape(n, 3)[:, :2].copy()
+    bezier_points.foreach_get("handle_left", buffer)
+    left = buffer.reshape(n, 3)[:, :2].copy()
+    bezier_points.foreach_get("handle_right", buffer)
+    right = buffer.reshape(n, 3)[:, :2].copy()
+
+    points = numpy.empty((3 * n + 1, 2), dtype=numpy.float32)
+    points[0:3 * n:3] = co
+    points[1::3] = right
+    points[2::3] = numpy.roll(left, -1, axis=0)
+    points[3 * n] = co[0]
+
+    # + 0.0 で -0.0 を 0.0 にそろえる
+    return points * SVG_FLIP * numpy.float32(scale) + numpy.float32(0.0)
+
+def path_template(segment_count):
+    return "M{},{} " + " ".join(["C {},{} {},{} {},{}"] * segment_count)
+
+def path_d(points):
+    # points は spline_points と同じ並びの (3m+1, 2) 配列
+    return path_template((len(points) - 1) // 3).format(*points.ravel().tolist())
+
+def polyline_template(point_count):
+    return "M{},{} " + " ".join(["L{},{}"] * (point_count - 1)) + " Z"
+
+def flatten(points, resolution=12, flatness=0.0, max_steps=256):
+    # 3次ベジエの制御点列を折れ線の頂点列 (k, 2) にする。終点は始点と同じなので含めない
+    # flatness > 0 なら区間ごとに平坦さから分割数を決める(Wang の式)
+    source = points.astype(numpy.float64)
+    segs = segments(source)
+    count = len(segs)
+
+    if flatness <= 0.0:
+        steps = numpy.full(count, max(1, resolution), dtype=numpy.int64)
+    else:
+        second_difference = numpy.maximum(
+            numpy.linalg.norm(segs[:, 0] - 2.0 * segs[:, 1] + segs[:, 2], axis=1),
+            numpy.linalg.norm(segs[:, 1] - 2.0 * segs[:, 2] + segs[:, 3], axis=1))
+        steps = numpy.clip(numpy.ceil(numpy.sqrt(0.75 * second_difference / flatness)), 1, max_steps).astype(numpy.int64)
+
+    offsets = numpy.concatenate(([0], numpy.cumsum(steps)))
+    result = numpy.empty((int(offsets[-1]), 2), dtype=numpy.float64)
+
+    # 分割数が同じ区間ごとにまとめて評価する
+    for step in numpy.unique(steps).tolist():
+        indices = numpy.nonzero(steps == step)[0]
+        values = evaluate(segs[indices], numpy.arange(step) / step)
+        result[offsets[indices][:, None] + numpy.arange(step)] = values
+
+    return result.astype(points.dtype)
+
+def bounds(points):
+    # ベジエ曲線は制御点の凸包に含まれるので、制御点の範囲を外接矩形とする
+    return points.min(axis=0), points.max(axis=0)
+
+def transform_instances(points, matrices):
+    # points: (N, 2), matrices: (k, 2, 3) -> (k, N, 2)
+    # 全インスタンスの制御点を一括で行列変換する
+    return numpy.einsum('kij,nj->kni', matrices[:, :, :2], points) + matrices[:, None, :, 2]
+
+def iter_transformed(points, matrices):
+    # 巨大なシートでもメモリが TRANSFORM_CHUNK_POINTS 程度に収まるようにインスタンスを分割する
+    chunk = max(1, TRANSFORM_CHUNK_POINTS // max(1, len(points)))
+    for start in range(0, len(matrices), chunk):
+        yield start, transform_instances(points, matrices[start:start + chunk])
+
+def segments(points):
+    # (3m+1, 2) の制御点列を (m, 4, 2) の区間ごとの配列にする
+    count = (len(points) - 1) // 3
+    return points[3 * numpy.arange(count)[:, None] + numpy.arange(4)]
+
+def bezier_basis(t):
+    mt = 1.0 - t
+    return numpy.stack((mt * mt * mt, 3.0 * mt * mt * t, 3.0 * mt * t * t, t * t * t), axis=-1)
+
+def evaluate(segments, t):
+    # 全区間をパラメータ t (k,) でまとめて評価する -> (m, k, 2)
+    return numpy.einsum('kj,mjd->mkd', bezier_basis(t), segments)
+
+def normalize(vector):
+    length = numpy.linalg.norm(vector)
+    if length < 1e-12:
+        return None
+    return vector / length
+
+def simplify(points, tolerance, samples=16, corner_angle=math.radians(10.0)):
+    # 曲線をサンプリングし、角(ハンドルが一直線でない点)で区切ってから、
+    # 許容誤差 tolerance 以内に収まる少ない区間数の3次ベジエで当てはめ直す
+    source = points.astype(numpy.float64)
+    segs = segments(source)
+    count = len(segs)
+    if count < 2 or tolerance <= 0.0:
+        return points
+
+    dense = evaluate(segs, numpy.linspace(0.0, 1.0, samples, endpoint=False))
+
+    out_dir = segs[:, 1] - segs[:, 0]
+    in_dir = segs[:, 0] - numpy.roll(segs[:, 2], 1, axis=0)
+    out_length = numpy.linalg.norm(out_dir, axis=1)
+    in_length = numpy.linalg.norm(in_dir, axis=1)
+    degenerate = (out_length < 1e-9) | (in_length < 1e-9)
+    cos = numpy.einsum('ij,ij->i', out_dir, in_dir) / numpy.maximum(out_length * in_length, 1e-18)
+    corner = degenerate | (cos < math.cos(corner_angle))
+    corner[0] = True
+
+    corners = numpy.nonzero(corner)[0].tolist() + [count]
+    result = [source[0]]
+    for start, end in zip(corners, corners[1:]):
+        run = numpy.concatenate((dense[start:end].reshape(-1, 2), source[3 * end][None, :]))
+
+        tangent_start = normalize(out_dir[start])
+        if tangent_start is None:
+            tangent_start = normalize(run[1] - run[0])
+        tangent_end = normalize(-in_dir[end % count])
+        if tangent_end is None:
+            tangent_end = normalize(run[-2] - run[-1])
+        if tangent_start is None or tangent_end is None:
+            # 長さのない区間はそのまま残す
+            result.extend(source[3 * start + 1:3 * end + 1])
+            continue
+
+        for bezier in fit_cubic(run, tangent_start, tangent_end, tolerance):
+            result.extend(bezier[1:])
+
+    if len(result) >= len(points):
+        return points
+
+    return numpy.array(result, dtype=points.dtype)
+
+def simplify_cached(key, points, tolerance):
+    signature = (hashlib.sha1(points.tobytes()).hexdigest(), tolerance)
+    cached = _simplify_cache.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    result = simplify(points, tolerance)
+    _simplify_cache[key] = (signature, result)
+    return result
+
+def fit_cubic(d, tangent_start, tangent_end, tolerance, max_iterations=4):
+    # Schneider のアルゴリズム。誤差が大きい点で分割しながら当てはめる
+    beziers = []
+    stack = [(d, tangent_start, tangent_end)]
+    while stack:
+        d, tangent_start, tangent_end = stack.pop()
+
+        if len(d) == 2:
+            distance = numpy.linalg.norm(d[1] - d[0]) / 3.0
+            beziers.append(numpy.array((d[0], d[0] + tangent_start * distance, d[1] + tangent_end * distance, d[1])))
+            continue
+
+        u = chord_length_parameters(d)
+        bezier = generate_bezier(d, u, tangent_start, tangent_end)
+        error, split = max_error(d, bezier, u)
+
+        if error > tolerance and error < tolerance * 4.0:
+            for iteration in range(max_iterations):
+                u = reparameterize(d, u, bezier)
+                bezier = generate_bezier(d, u, tangent_start, tangent_end)
+                error, split = max_error(d, bezier, u)
+                if error <= tolerance:
+                    break
+
+        if error <= tolerance:
+            beziers.append(bezier)
+            continue
+
+        tangent_center = normalize(d[split - 1] - d[split + 1])
+        if tangent_center is None:
+            tangent_center = normalize(d[split - 1] - d[split])
+        if tangent_center is None:
+            beziers.append(bezier)
+            continue
+
+        # 後半を先に積んで、前半から順に出力されるようにする
+        stack.append((d[split:], -tangent_center, tangent_end))
+        stack.append((d[:split + 1], tangent_start, tangent_center))
+
+    return beziers
+
+def chord_length_parameters(d):
+    lengths = numpy.concatenate(([0.0], numpy.cumsum(numpy.linalg.norm(numpy.diff(d, axis=0), axis=1))))
+    if lengths[-1] <= 0.0:
+        return numpy.linspace(0.0, 1.0, len(d))
+    return lengths / lengths[-1]
+
+def generate_bezier(d, u, tangent_start, tangent_end):
+    first = d[0]
+    last = d[-1]
+    basis = bezier_basis(u)
+
+    a1 = basis[:, 1, None] * tangent_start
+    a2 = basis[:, 2, None] * tangent_end
+    c00 = numpy.einsum('ij,ij->', a1, a1)
+    c01 = numpy.einsum('ij,ij->', a1, a2)
+    c11 = numpy.einsum('ij,ij->', a2, a2)
+    rest = d - (basis[:, 0, None] + basis[:, 1, None]) * first - (basis[:, 2, None] + basis[:, 3, None]) * last
+    x0 = numpy.einsum('ij,ij->', a1, rest)
+    x1 = numpy.einsum('ij,ij->', a2, rest)
+
+    segment_length = numpy.linalg.norm(last - first)
+    epsilon = 1e-6 * segment_length
+    det = c00 * c11 - c01 * c01
+    alpha_start = alpha_end = segment_length / 3.0
+    if abs(det) > 1e-12:
+        alpha_start = (x0 * c11 - x1 * c01) / det
+        alpha_end = (c00 * x1 - c01 * x0) / det
+    if alpha_start < epsilon or alpha_end < epsilon:
+        alpha_start = alpha_end = segment_length / 3.0
+
+    return numpy.array((first, first + tangent_start * alpha_start, last + tangent_end * alpha_end, last))
+
+def max_error(d, bezier, u):
+    distances = numpy.linalg.norm(evaluate(bezier[None], u)[0] - d, axis=1)
+    split = int(numpy.argmax(distances))
+    if split <= 0 or split >= len(d) - 1:
+        split = len(d) // 2
+    return float(distances.max()), split
+
+def reparameterize(d, u, bezier):
+    # Newton 法で各点に最も近い曲線上のパラメータへ寄せる
+    q = evaluate(bezier[None], u)[0]
+    first_derivative = 3.0 * (bezier[1:] - bezier[:-1])
+    second_derivative = 2.0 * (first_derivative[1:] - first_derivative[:-1])
+    mt = 1.0 - u
+    q1 = (mt * mt)[:, None] * first_derivative[0] + (2.0 * mt * u)[:, None] * first_derivative[1] + (u * u)[:, None] * first_derivative[2]
+    q2 = mt[:, None] * second_derivative[0] + u[:, None] * second_derivative[1]
+
+    difference = q - d
+    numerator = numpy.einsum('ij,ij->i', difference, q1)
+    denominator = numpy.einsum('ij,ij->i', q1, q1) + numpy.einsum('ij,ij->i', difference, q2)
+    step = numpy.divide(numerator, denominator, out=numpy.zeros_like(numerator), where=numpy.abs(denominator) > 1e-12)
+    return numpy.clip(u - step, 0.0, 1.0)
@@ -0,0 +1,143 @@
+import numpy
+
+# z 位置の一括編集。位置は foreach_get/foreach_set でまとめて読み書きし、RNA をオブジェクトごとに触らない
+
+def get_vectors(objects, attribute, dtype=numpy.float32):
+    buffer = numpy.empty(len(objects) * 3, dtype=dtype)
+    objects.foreach_get(attribute, buffer)
+    return buffer.reshape(-1, 3)
+
+def set_vectors(objects, attribute, values):
+    objects.foreach_set(attribute, values.ravel())
+
+def get_index_map(objects):
+    # objects.find は線形探索なので、操作ごとに一度だけ対応表を作る
+    return {obj.as_pointer(): index for index, obj in enumerate(objects)}
+
+def get_indices(index_map, targets):
+    indices = [index_map.get(obj.as_pointer(), -1) for obj in targets]
+    return numpy.array([index for index in indices if index >= 0], dtype=numpy.int64)
+
+def get_collections(targets):
+    collections = []
+    for obj in targets:
+        for collection in obj.users_collection:
+            if collection not in collections:
+                collections.append(collection)
+    return collections
+
+def write_z(objects, locations, changed):
+    set_vectors(objects, "location", locations)
+    # foreach_set では更新が通知されないので変更したオブジェクトだけ再評価させる
+    # scene.objects は番号で引くたびに先頭からたどるので、一度だけリストにする
+    object_list = list(objects)
+    for index in changed.tolist():
+        object_list[index].update_tag(refresh={'OBJECT'})
+
+def move(context, delta):
+    objects = context.scene.objects
+    index_map = get_index_map(objects)
+    selected = get_indices(index_map, context.selected_objects)
+    if len(selected) <= 0:
+        return 0
+
+    locations = get_vectors(objects, "location")
+    locations[selected, 2] += delta
+    write_z(objects, locations, selected)
+    return len(selected)
+
+def reset(context):
+    objects = context.scene.objects
+    index_map = get_index_map(objects)
+    selected = get_indices(index_map, context.selected_objects)
+    if len(selected) <= 0:
+        return 0
+
+    locations = get_vectors(objects, "location")
+    locations[selected, 2] = 0.0
+    write_z(objects, locations, selected)
+    return len(selected)
+
+def bring_to(context, front, step):
+    # 選択中のオブジェクトを他のすべてのオブジェクトより前(後ろ)へ移す。選択中どうしの順序は保つ
+    objects = context.scene.objects
+    index_map = get_index_map(objects)
+    selected = get_indices(index_map, context.selected_objects)
+    if len(selected) <= 0:
+        return 0
+
+    # 比べる相手は選択中のオブジェクトと同じコレクションに入っているもの
+    others = numpy.zeros(len(objects), dtype=bool)
+    for collection in get_collections(context.selected_objects):
+        others[get_indices(index_map, collection.objects)] = True
+    others[selected] = False
+
+    locations = get_vectors(objects, "location")
+
+    order = selected[numpy.argsort(locations[selected, 2], kind='stable')]
+    ranks = numpy.arange(1, len(order) + 1, dtype=numpy.float32)
+    if not others.any():
+        base = locations[selected, 2].max() if front else locations[selected, 2].min()
+    elif front:
+        base = locations[others, 2].max()
+    else:
+        base = locations[others, 2].min()
+
+    if front:
+        locations[order, 2] = base + ranks * step
+    else:
+        locations[order, 2] = base - (len(order) + 1 - ranks) * step
+
+    write_z(objects, locations, selected)
+    return len(selected)
+
+def swap(context):
+    objects = context.scene.objects
+    index_map = get_index_map(objects)
+    selected = get_indices(index_map, context.selected_objects)
+    if len(selected) != 2:
+        return 0
+
+    locations = get_vectors(objects, "location")
+    locations[selected, 2] = locations[selected[::-1], 2]
+    write_z(objects, locations, selected)
+    return 2
+
+def renormalize(context, collections, step):
+    # コレクション内の z を step 間隔に並べ直す。同じ z のものは書き出し時と同じく collection.objects の順を保つ
+    objects = context.scene.objects
+    index_map = get_index_map(objects)
+    locations = get_vectors(objects, "location")
+    changed = []
+
+    for collection in collections:
+        members = get_indices(index_map, collection.objects)
+        if len(members) <= 0:
+            continue
+
+        order = members[numpy.argsort(locations[members, 2], kind='stable')]
+        locations[order, 2] = numpy.arange(len(order), dtype=numpy.float32) * step
+        changed.append(order)
+
+    if not changed:
+        return 0
+
+    changed = numpy.unique(numpy.concatenate(changed))
+    write_z(objects, locations, changed)
+    return len(changed)
+
+def set_locks(context, value):
+    # X, Y の位置と拡大縮小のロックを切り替える
+    objects = context.scene.objects
+    index_map = get_index_map(objects)
+    selected = get_indices(index_map, context.selected_objects)
+    if len(selected) <= 0:
+        return 0
+
+    for attribute in ("lock_location", "lock_scale"):
+        locks = get_vectors(objects, attribute, dtype=bool)
+        locks[selected, 0] = value
+        locks[selected, 1] = value
+        set_vectors(objects, attribute, locks)
+
+    return len(selected)
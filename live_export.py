@@ -0,0 +1,250 @@
+import bpy
+import logging
+import os
+import time
+from bpy.app.handlers import persistent
+from . import data_source
+from . import fingerprint
+from . import paging
+from . exporter import WrappingPaperMixin
+
+logger = logging.getLogger("wrapping_paper_tools")
+
+# これらが変わると全コレクションのパスを作り直す
+GEOMETRY_PROPERTIES = {"scale", "export_mode", "use_simplify", "simplify_tolerance", "use_polyline", "use_adaptive_resolution", "flatness"}
+# これらが変わっても出力は変わらない
+IGNORED_PROPERTIES = fingerprint.IGNORED_SCENE_PROPERTIES | {"export_path"}
+
+class LiveBuilder(WrappingPaperMixin):
+    pass
+
+class LiveExport():
+    # 変更のあった部分(コレクションの <defs>、配置、背景)だけを作り直して出力ファイルを書き直す
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.groups = {}
+        self.paths = {}
+        self.collection_names = None
+        self.background = None
+        self.instances = None
+        self.scene_values = None
+        self.data_signatures = None
+        self.last_error = None
+
+        self.dirty_collections = set()
+        self.dirty_all = True
+        self.dirty_instances = True
+        self.dirty_background = True
+        self.last_change = 0.0
+        self.scheduled = False
+
+    def mark_collections(self, names):
+        self.dirty_collections.update(names)
+        self.touch()
+
+    def mark_scene(self, scene):
+        values = get_scene_values(scene)
+        if self.scene_values is not None and values == self.scene_values:
+            return
+
+        changed = set(values) if self.scene_values is None else {key for key in values if values[key] != self.scene_values.get(key)}
+        self.scene_values = values
+
+        if changed & GEOMETRY_PROPERTIES:
+            self.dirty_all = True
+        self.dirty_instances = True
+        self.dirty_background = True
+        self.touch()
+
+    def touch(self):
+        self.last_change = time.monotonic()
+        if not self.scheduled:
+            self.scheduled = True
+            bpy.app.timers.register(on_timer, first_interval=get_delay())
+
+    def flush(self):
+        # 最後の変更から delay 秒たつまで待つ
+        remaining = self.last_change + get_delay() - time.monotonic()
+        if remaining > 0.0:
+            return remaining
+
+        self.scheduled = False
+        scene = bpy.context.scene
+        if scene is None or not scene.wpt_scene_properties.use_live_export:
+            return None
+
+        try:
+            self.export(scene)
+            self.last_error = None
+        except (OSError, ValueError) as error:
+            # 外部データが見つからない、読めない場合。直るまで同じ内容を何度も出さない
+            message = data_source.get_error_message(error)
+            if message != self.last_error:
+                logger.error("live export skipped: " + message)
+                self.last_error = message
+        except Exception:
+            logger.exception("live export failed")
+            self.dirty_all = True
+
+        return None
+
+    def export(self, scene):
+        logger.info("start")
+        wpt_scene_properties = scene.wpt_scene_properties
+        export_path = bpy.path.abspath(wpt_scene_properties.export_path)
+        width = wpt_scene_properties.width
+        height = wpt_scene_properties.height
+
+        builder = LiveBuilder()
+        builder.get_objects()
+        builder.create_drawing(bpy.context, None)
+
+        collection_names = [collection.name for collection in builder.collections]
+        if collection_names != self.collection_names:
+            # コレクションの構成が変わると番号がずれるので全部作り直す
+            self.dirty_all = True
+            self.collection_names = collection_names
+
+        # 縞模様と円のデータはテキストや外部ファイルの内容で比べる
+        data_signatures = (
+            data_source.get_signature(wpt_scene_properties.stripe_data_path, "stripe_data.csv") if wpt_scene_properties.use_stripe_background else None,
+            data_source.get_signature(wpt_scene_properties.circles_data_path, "circles_data.csv") if wpt_scene_properties.pattern_type == "3" else None)
+        if self.data_signatures is not None and data_signatures[0] != self.data_signatures[0]:
+            self.dirty_background = True
+        if self.data_signatures is not None and data_signatures[1] != self.data_signatures[1]:
+            self.dirty_instances = True
+        self.data_signatures = data_signatures
+
+        if self.dirty_all:
+            self.groups = {}
+            self.paths = {}
+            self.dirty_collections = set(collection_names)
+            self.dirty_instances = True
+            self.dirty_background = True
+
+        use_defs = wpt_scene_properties.export_mode == "0"
+        rebuilt = []
+        for collection in builder.collections:
+            if collection.name not in self.dirty_collections and collection.name in self.paths:
+                continue
+            svg_group = builder.create_group(collection, use_defs)
+            self.groups[collection.name] = svg_group.tostring() if use_defs else ""
+            self.paths[collection.name] = builder.paths[collection.name]
+            rebuilt.append(collection.name)
+
+        # 配置は各コレクションの外接矩形や Flattened, Proof のパスに依存する場合がある
+        if rebuilt and (wpt_scene_properties.export_mode != "0" or wpt_scene_properties.use_clearance_noise):
+            self.dirty_instances = True
+
+        if self.dirty_background:
+            self.background = builder.get_background_markup()
+
+        if self.dirty_instances:
+            builder.paths = dict(self.paths)
+            builder.create_points(width, height)
+            builder.create_uses()
+            self.instances = ''.join(builder.get_instance_markup())
+            if builder.svg.defs.elements:
+                # Proof の画像
+                self.instances = builder.svg.defs.tostring() + self.instances
+
+        parts = []
+        if use_defs:
+            parts.append("<defs>")
+            parts.extend(self.groups[name] for name in collection_names)
+            parts.append("</defs>")
+        parts.append(self.background)
+        parts.append(self.instances)
+        # 他のツールが書きかけのファイルを読まないよう、一時ファイルに書いてから置き換える
+        temp_path = export_path + ".tmp"
+        paging.write_page(temp_path, (-width/2, -height/2), (width/2, height/2), parts)
+        os.replace(temp_path, export_path)
+
+        logger.info("end: {0} groups rebuilt, instances {1}".format(len(rebuilt), "rebuilt" if self.dirty_instances else "reused"))
+
+        self.dirty_collections = set()
+        self.dirty_all = False
+        self.dirty_instances = False
+        self.dirty_background = False
+
+live_export = LiveExport()
+
+def on_timer():
+    return live_export.flush()
+
+def get_delay():
+    scene = bpy.context.scene
+    if scene is None:
+        return 1.0
+    return scene.wpt_scene_properties.live_export_delay
+
+def get_scene_values(scene):
+    values = {}
+    wpt_scene_properties = scene.wpt_scene_properties
+    for prop in wpt_scene_properties.bl_rna.properties:
+        if prop.identifier in IGNORED_PROPERTIES:
+            continue
+        value = getattr(wpt_scene_properties, prop.identifier)
+        if getattr(prop, "is_array", False):
+            value = tuple(value)
+        values[prop.identifier] = value
+    return values
+
+def get_object_collections(obj):
+    return [collection.name for collection in obj.users_collection]
+
+@persistent
+def on_depsgraph_update(scene, depsgraph=None):
+    if not scene.wpt_scene_properties.use_live_export:
+        return
+
+    if depsgraph is None:
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+
+    for update in depsgraph.updates:
+        data = update.id.original
+
+        if isinstance(data, bpy.types.Object):
+            if data.type == 'CURVE' and (update.is_updated_transform or update.is_updated_geometry):
+                live_export.mark_collections(get_object_collections(data))
+        elif isinstance(data, (bpy.types.Curve, bpy.types.Material)):
+            # このデータを使っているオブジェクトのコレクション
+            for obj in bpy.data.objects:
+                if obj.type != 'CURVE':
+                    continue
+                if obj.data == data or data in obj.data.materials[:]:
+                    live_export.mark_collections(get_object_collections(obj))
+        elif isinstance(data, bpy.types.Collection):
+            live_export.mark_collections([data.name])
+            live_export.dirty_instances = True
+        elif isinstance(data, bpy.types.Scene):
+            live_export.mark_scene(data)
+        elif isinstance(data, bpy.types.Text):
+            # 縞模様や円のデータ。変わったかどうかは書き出し時に内容で比べる
+            live_export.touch()
+
+def update_use_live_export(self, context):
+    live_export.reset()
+    if self.use_live_export:
+        live_export.touch()
+
+@persistent
+def on_load_post(*args):
+    # 前のファイルのマークアップを使わないようにする。読み込みでタイマーも消えるので予約も取り消す
+    if bpy.app.timers.is_registered(on_timer):
+        bpy.app.timers.unregister(on_timer)
+    live_export.reset()
+
+def register():
+    bpy.app.handlers.depsgraph_update_post.append(on_depsgraph_update)
+    bpy.app.handlers.load_post.append(on_load_post)
+
+def unregister():
+    if on_depsgraph_update in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(on_depsgraph_update)
+    if on_load_post in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(on_load_post)
+    if bpy.app.timers.is_registered(on_timer):
+        bpy.app.timers.unregister(on_timer)
@@ -0,0 +1,85 @@
+import csv
+import json
+import numpy
+import os
+import struct
+
+# 配置の一覧を、列ごとにまとめたバイナリ (.wptm) と CSV で書き出す
+#
+# .wptm の形式(リトルエンディアン)
+#   "WPTM", バージョン (uint16), ヘッダの長さ (uint32), ヘッダ (UTF-8 の JSON)
+#   以降はブロックの繰り返し: 行数 (uint32), 各列の値を COLUMNS の順に行数分ずつ
+MAGIC = b"WPTM"
+MANIFEST_VERSION = 1
+# 一度に書き出す行数。シートが大きくてもこの行数分しかメモリを使わない
+MANIFEST_CHUNK_ROWS = 1 << 16
+COLUMNS = (
+    ("x", "<f4"),
+    ("y", "<f4"),
+    ("collection", "<u2"),
+    ("rotation", "<f4"),
+    ("scale", "<f4"),
+)
+
+def get_paths(export_path):
+    stem, extension = os.path.splitext(export_path)
+    return stem + ".placements.wptm", stem + ".placements.csv"
+
+def iter_chunks(placements, chunk_rows=MANIFEST_CHUNK_ROWS):
+    for start in range(0, len(placements), chunk_rows):
+        end = min(start + chunk_rows, len(placements))
+        yield start, [getattr(placements, name)[start:end] for name, dtype in COLUMNS]
+
+def write(export_path, placements, collection_names, seed):
+    binary_path, csv_path = get_paths(export_path)
+
+    header = json.dumps({
+        "rows": len(placements),
+        "chunk_rows": MANIFEST_CHUNK_ROWS,
+        "columns": [[name, dtype] for name, dtype in COLUMNS],
+        "collections": collection_names,
+        "seed": seed,
+        # x, y は SVG の座標、rotation は度
+        "coordinates": "svg",
+    }).encode("utf-8")
+
+    with open(binary_path, "wb") as binary_file, open(csv_path, "w", newline="", encoding="utf-8") as csv_file:
+        binary_file.write(MAGIC + struct.pack("<HI", MANIFEST_VERSION, len(header)) + header)
+
+        writer = csv.writer(csv_file)
+        writer.writerow(("index", "x", "y", "collection", "rotation", "scale", "seed"))
+
+        for start, columns in iter_chunks(placements):
+            binary_file.write(struct.pack("<I", len(columns[0])))
+            for (name, dtype), values in zip(COLUMNS, columns):
+                binary_file.write(numpy.ascontiguousarray(values, dtype=dtype).tobytes())
+
+            x, y, collection, rotation, scale = [values.tolist() for values in columns]
+            writer.writerows(
+                (start + offset, x[offset], y[offset], collection_names[collection[offset]], rotation[offset], scale[offset], seed)
+                for offset in range(len(x)))
+
+    return binary_path, csv_path
+
+def read(path):
+    # .wptm を読んで (ヘッダ, 列名 -> 配列) を返す
+    with open(path, "rb") as f:
+        if f.read(4) != MAGIC:
+            raise ValueError("not a placement manifest: " + path)
+        version, header_length = struct.unpack("<HI", f.read(6))
+        if version != MANIFEST_VERSION:
+            raise ValueError("unsupported manifest version: {0}".format(version))
+        header = json.loads(f.read(header_length).decode("utf-8"))
+
+        columns = {name: numpy.empty(header["rows"], dtype=dtype) for name, dtype in header["columns"]}
+        start = 0
+        while start < header["rows"]:
+            rows, = struct.unpack("<I", f.read(4))
+            for name, dtype in header["columns"]:
+                values = numpy.fromfile(f, dtype=dtype, count=rows)
+                if len(values) != rows:
+                    raise ValueError("truncated manifest: " + path)
+                columns[name][start:start + rows] = values
+            start += rows
+
+    return header, columns
@@ -0,0 +1,47 @@
+import concurrent.futures
+import math
+import os
+
+PAGE_HEADER = ('<?xml version="1.0" encoding="utf-8" ?>\n'
+    '<svg baseProfile="full" height="{height}" version="1.1" viewBox="{x} {y} {width} {height}" width="{width}" '
+    'xmlns="http://www.w3.org/2000/svg" xmlns:ev="http://www.w3.org/2001/xml-events" xmlns:xlink="http://www.w3.org/1999/xlink">')
+PAGE_FOOTER = '</svg>\n'
+
+def page_boxes(width, height, page_width, page_height, overlap):
+    # シート (-width/2, -height/2)-(width/2, height/2) を左上から順に page_width x page_height のページに分ける
+    # 隣り合うページは overlap だけ重なる
+    step_x = max(page_width - overlap, 1)
+    step_y = max(page_height - overlap, 1)
+    columns = max(1, math.ceil((width - overlap) / step_x))
+    rows = max(1, math.ceil((height - overlap) / step_y))
+
+    pages = []
+    for row in range(rows):
+        for column in range(columns):
+            min_x = -width / 2 + column * step_x
+            min_y = -height / 2 + row * step_y
+            pages.append((row, column, (min_x, min_y), (min_x + page_width, min_y + page_height)))
+
+    return pages
+
+def page_path(export_path, row, column):
+    stem, extension = os.path.splitext(export_path)
+    return "{0}_r{1:02d}_c{2:02d}{3}".format(stem, row + 1, column + 1, extension or ".svg")
+
+def write_page(path, page_min, page_max, parts):
+    width = page_max[0] - page_min[0]
+    height = page_max[1] - page_min[1]
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(PAGE_HEADER.format(x=page_min[0], y=page_min[1], width=width, height=height))
+        for part in parts:
+            f.write(part)
+        f.write(PAGE_FOOTER)
+
+    return path
+
+def write_pages(jobs, max_workers=None):
+    # jobs: (path, page_min, page_max, parts) のリスト
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or min(8, os.cpu_count() or 1)) as executor:
+        futures = [executor.submit(write_page, *job) for job in jobs]
+        return [future.result() for future in futures]
@@ -0,0 +1,55 @@
+import numpy
+
+class Placements():
+    # create_uses で決まったインスタンスの配置。座標は SVG 座標系、回転は度
+    def __init__(self):
+        self.collection = []
+        self.x = []
+        self.y = []
+        self.rotation = []
+        self.scale = []
+
+    def __len__(self):
+        return len(self.x)
+
+    def append(self, collection, x, y, rotation=0.0, scale=1.0):
+        self.collection.append(collection)
+        self.x.append(x)
+        self.y.append(y)
+        self.rotation.append(rotation)
+        self.scale.append(scale)
+
+    def set_columns(self, collection, x, y, rotation, scale):
+        # 配列からまとめて設定する。1件ずつ append しない
+        self.collection = collection
+        self.x = x
+        self.y = y
+        self.rotation = rotation
+        self.scale = scale
+
+    def finalize(self):
+        # すでに配列ならコピーしない
+        self.collection = numpy.asarray(self.collection, dtype=numpy.int32)
+        self.x = numpy.asarray(self.x, dtype=numpy.float64)
+        self.y = numpy.asarray(self.y, dtype=numpy.float64)
+        self.rotation = numpy.asarray(self.rotation, dtype=numpy.float64)
+        self.scale = numpy.asarray(self.scale, dtype=numpy.float64)
+
+    def matrices(self, indices=None):
+        # (k, 2, 3) のアフィン行列。(x, y) を中心に回転・拡大し、(x, y) へ平行移動する
+        if indices is None:
+            indices = slice(None)
+
+        radians = numpy.radians(self.rotation[indices])
+        scale = self.scale[indices]
+        cos = numpy.cos(radians) * scale
+        sin = numpy.sin(radians) * scale
+
+        matrices = numpy.empty((len(cos), 2, 3), dtype=numpy.float64)
+        matrices[:, 0, 0] = cos
+        matrices[:, 0, 1] = -sin
+        matrices[:, 0, 2] = self.x[indices]
+        matrices[:, 1, 0] = sin
+        matrices[:, 1, 1] = cos
+        matrices[:, 1, 2] = self.y[indices]
+        return matrices
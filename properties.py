@@ -5,7 +5,10 @@ import math
 import mathutils
 import os
 import bgl
-from . exporter import SvgExporter
+from . import layering
+from . import live_export
+from . exporter import SvgExporter, CheckInstances
+from . sequence import SequenceExporter
 from bpy.props import PointerProperty, StringProperty, CollectionProperty, IntProperty, BoolProperty, IntVectorProperty, FloatVectorProperty, FloatProperty, EnumProperty, BoolVectorProperty
 from bpy.app.translations import pgettext
 from bpy.types import Panel, Operator, SpaceView3D, PropertyGroup
@@ -21,6 +24,31 @@ class SVGSceneProperties(PropertyGroup):
     slide_sub: FloatProperty(name="Slide", step=10, default=0.02)
     # 出力系
     export_path: StringProperty(name="Export path", subtype='FILE_PATH', description="Export path", default="//sample.svg")
+    export_mode: EnumProperty(
+        name="Export mode",
+        items=(('0', "Standard", "Instances reference the collection groups with <use>"),('1', "Flattened", "Expand every instance into plain paths for print RIPs"),('2', "Proof", "Rasterize each collection once and place the images, for lightweight client proofs")),
+        default='0'
+    )
+    proof_density: FloatProperty(name="Proof density", min=0.1, soft_max=8.0, default=2.0, precision=1, description="Raster pixels per SVG unit at the size of the largest instance")
+    use_matrix_transform: BoolProperty(name="Matrix transforms", default=True, description="Write each instance as one <use> with a precomputed matrix() transform")
+    use_simplify: BoolProperty(name="Simplify curves", default=False, description="Refit splines with fewer Bezier segments before writing them")
+    simplify_tolerance: FloatProperty(name="Tolerance", min=0.0, soft_max=10.0, default=0.5, precision=2, description="Maximum distance in px between the original and the simplified curve")
+    use_polyline: BoolProperty(name="Polylines", default=False, description="Write curves as polylines evaluated at the curve resolution")
+    use_adaptive_resolution: BoolProperty(name="Adaptive resolution", default=False, description="Choose the number of steps per segment from its flatness instead of the curve resolution")
+    flatness: FloatProperty(name="Flatness", min=0.001, soft_max=10.0, default=0.25, precision=3, description="Maximum distance in px between the curve and the polyline")
+    use_live_export: BoolProperty(name="Live export", default=False, description="Keep the exported SVG in sync with the scene, re-generating only the parts that changed", update=live_export.update_use_live_export)
+    live_export_delay: FloatProperty(name="Delay", min=0.1, soft_max=10.0, default=1.0, precision=1, description="Seconds to wait after the last change before writing")
+    use_manifest: BoolProperty(name="Placement manifest", default=False, description="Also write the placements as a columnar binary file and a CSV next to the SVG")
+    sequence_format: EnumProperty(
+        name="Sequence",
+        items=(('0', "Frames", "Write one SVG file per frame"),('1', "SMIL", "Write a single SVG animated with SMIL")),
+        default='0'
+    )
+    use_pages: BoolProperty(name="Split into pages", default=False, description="Write the sheet as page-sized tiles instead of one file")
+    page_width: IntProperty(name="Page width", min=4, max=65536, default=4096)
+    page_height: IntProperty(name="Page height", min=4, max=65536, default=4096)
+    page_overlap: FloatProperty(name="Overlap", min=0.0, default=0.0, precision=1)
+    page_bleed: FloatProperty(name="Bleed", min=0.0, default=0.0, precision=1)
     # 枠・背景
     draw_area: BoolProperty(default=False)
     height: IntProperty(name="Height", min=4, max=65536, default=3955)
@@ -29,12 +57,14 @@ class SVGSceneProperties(PropertyGroup):
     use_background: BoolProperty(name="Use backGround", default=False)
     use_stripe_background: BoolProperty(name="Use stripe backGround", default=False)
     background_color: FloatVectorProperty(name="Background Color", subtype='COLOR', size=4, min=0, max=1, default=[0.0, 0.0, 0.0, 1.0])
+    stripe_data_path: StringProperty(name="Stripe data", subtype='FILE_PATH', description="External stripe data (.csv, .npy, .f32). Uses the stripe_data.csv text block when empty", default="")
     # パターン系
     use_location_noise: BoolProperty(name="Use location noise", default=False)
     distance_x: FloatProperty(name="Distance X", min=0.0, default=500.0, precision=1)
     distance_y: FloatProperty(name="Distance Y", min=0.0, default=500.0, precision=1)
     offset_y: FloatProperty(name="Offset Y", min=0.0, default=0.0, precision=1)
     location_noise: FloatProperty(name="Location noise", min=0.0, default=0.0, precision=3)
+    use_clearance_noise: BoolProperty(name="Keep clearance", default=False, description="Reject location noise that would bring instance bounds closer than the clearance")
     use_rotation_noise: BoolProperty(name="Use rotation noise", default=False)
     rotation_noise: FloatProperty(name="Rotation noise", min=0.0, soft_max=math.radians(20), default=0.0, precision=3, unit='ROTATION')
     random_seed: IntProperty(name="Seed", min=1, default=1)
@@ -45,9 +75,17 @@ class SVGSceneProperties(PropertyGroup):
     )
     yagasuri_turn: BoolProperty(name="Turn", default=False)
     collection_index_offset: IntProperty(name="Group index offset", min=0, default=0)
+    circles_data_path: StringProperty(name="Circles data", subtype='FILE_PATH', description="External circle data (.csv, .npy, .f32). Uses the circles_data.csv text block when empty", default="")
+    avoid_same_neighbors: BoolProperty(name="Avoid same neighbors", default=False)
+    # チェック系
+    clearance: FloatProperty(name="Clearance", min=0.0, default=0.0, precision=1, description="Minimum gap between instance bounds")
+    use_clearance_markers: BoolProperty(name="Clearance markers", default=False, description="Outline overlapping and too close instances in the exported SVG")
+    overlap_count: IntProperty(name="Overlaps", default=-1)
+    clearance_count: IntProperty(name="Too close", default=-1)
 
 class SVGCollectionProperties(PropertyGroup):
     export: BoolProperty(name="Export", default=False)
+    weight: FloatProperty(name="Weight", min=0.0, soft_max=10.0, default=1.0, precision=2)
 
 # Operator
 class InitProjectOperator(Operator):
@@ -120,6 +158,12 @@ class VIEW3D_PT_tools_wpt(Panel):
         row.operator(UpObjectSub.bl_idname, icon='TRIA_UP_BAR')
         row.operator(DownObjectSub.bl_idname, icon='TRIA_DOWN_BAR')
         col.prop(wpt_scene_properties, "slide_sub")
+        row = col.row(align=True)
+        row.operator(FrontObject.bl_idname, icon='TRIA_UP_BAR')
+        row.operator(BackObject.bl_idname, icon='TRIA_DOWN_BAR')
+        row = col.row(align=True)
+        row.operator(SwapObject.bl_idname, icon='ARROW_LEFTRIGHT')
+        row.operator(RenormalizeObject.bl_idname, icon='ALIGN_JUSTIFY')
         col.operator(ResetObject.bl_idname, icon='X')
 
         if context.object is not None:
@@ -150,6 +194,46 @@ class VIEW3D_PT_tools_wpt(Panel):
         row.label(text="Output")
         row = layout.row()
         row.prop(wpt_scene_properties, "export_path", text="")
+        row = layout.row()
+        row.prop(wpt_scene_properties, "export_mode", text="")
+
+        if wpt_scene_properties.export_mode != "1": # Standard, Proof
+            row = layout.row()
+            row.prop(wpt_scene_properties, "use_matrix_transform")
+        if wpt_scene_properties.export_mode == "2": # Proof
+            row.prop(wpt_scene_properties, "proof_density")
+
+        row = layout.row()
+        row.prop(wpt_scene_properties, "use_simplify")
+        if wpt_scene_properties.use_simplify:
+            row.prop(wpt_scene_properties, "simplify_tolerance")
+
+        col = layout.column(align=True)
+        row = col.row(align=True)
+        row.prop(wpt_scene_properties, "use_polyline")
+        if wpt_scene_properties.use_polyline:
+            row.prop(wpt_scene_properties, "use_adaptive_resolution")
+            if wpt_scene_properties.use_adaptive_resolution:
+                row = col.row(align=True)
+                row.prop(wpt_scene_properties, "flatness")
+
+        row = layout.row()
+        row.prop(wpt_scene_properties, "use_manifest")
+
+        row = layout.row()
+        row.prop(wpt_scene_properties, "use_pages")
+        if wpt_scene_properties.use_pages:
+            col = layout.column(align=True)
+            row = col.row(align=True)
+            row.prop(wpt_scene_properties, "page_width")
+            row.prop(wpt_scene_properties, "page_height")
+            row = col.row(align=True)
+            row.prop(wpt_scene_properties, "page_overlap")
+            row.prop(wpt_scene_properties, "page_bleed")
+            if wpt_scene_properties.page_overlap * 2 > min(wpt_scene_properties.page_width, wpt_scene_properties.page_height):
+                row = col.row()
+                row.alert = True
+                row.label(text="Page overlap must be at most half the page size")
 
         if not bpy.data.is_saved:
             row = layout.row()
@@ -163,8 +247,25 @@ class VIEW3D_PT_tools_wpt(Panel):
         if not bpy.data.is_saved:
             row.enabled = False
         row = col.row(align=True)
+        row.operator(SvgExporter.bl_idname, text="Force Export", icon='FILE_REFRESH').force = True
+        if not bpy.data.is_saved:
+            row.enabled = False
+        row = col.row(align=True)
         row.operator(OpenSvg.bl_idname, icon='WORLD')
 
+        row = layout.row(align=True)
+        row.prop(wpt_scene_properties, "use_live_export")
+        if wpt_scene_properties.use_live_export:
+            row.prop(wpt_scene_properties, "live_export_delay")
+        if not bpy.data.is_saved:
+            row.enabled = False
+
+        row = layout.row(align=True)
+        row.prop(wpt_scene_properties, "sequence_format", text="")
+        row.operator(SequenceExporter.bl_idname, icon='RENDER_ANIMATION')
+        if not bpy.data.is_saved:
+            row.enabled = False
+
         # 枠・背景
         layout.row().separator()
 
@@ -197,10 +298,18 @@ class VIEW3D_PT_tools_wpt(Panel):
         row = layout.row()
         row.prop(wpt_scene_properties, "use_stripe_background", text="Use stripe background")
 
+        if wpt_scene_properties.use_stripe_background:
+            row = layout.row()
+            row.prop(wpt_scene_properties, "stripe_data_path", text="")
+
         layout.row().separator()
 
         self.draw_pattern(context)
 
+        layout.row().separator()
+
+        self.draw_check(context)
+
     def draw_collection(self, context):
         layout = self.layout
         layout.row().separator()
@@ -217,6 +326,7 @@ class VIEW3D_PT_tools_wpt(Panel):
                     wpt_collection_properties = collection.wpt_collection_properties
                     row = layout.row()
                     row.prop(wpt_collection_properties, "export")
+                    row.prop(wpt_collection_properties, "weight")
 
         col = layout.column(align=True)
         row = col.row(align=True)
@@ -263,6 +373,13 @@ class VIEW3D_PT_tools_wpt(Panel):
                 row = layout.row()
                 row.prop(wpt_scene_properties, "location_noise")
 
+                col = layout.column(align=True)
+                row = col.row(align=True)
+                row.prop(wpt_scene_properties, "use_clearance_noise")
+                if wpt_scene_properties.use_clearance_noise:
+                    row = col.row(align=True)
+                    row.prop(wpt_scene_properties, "clearance")
+
             row = layout.row()
             row.prop(wpt_scene_properties, "use_rotation_noise")
 
@@ -270,6 +387,9 @@ class VIEW3D_PT_tools_wpt(Panel):
                 row = layout.row()
                 row.prop(wpt_scene_properties, "rotation_noise")
 
+            row = layout.row()
+            row.prop(wpt_scene_properties, "avoid_same_neighbors")
+
             row = layout.row()
             row.prop(wpt_scene_properties, "random_seed")
 
@@ -292,6 +412,34 @@ class VIEW3D_PT_tools_wpt(Panel):
             row = col.row(align=True)
             row.prop(wpt_scene_properties, "collection_index_offset")
 
+            row = layout.row()
+            row.prop(wpt_scene_properties, "circles_data_path", text="")
+
+    def draw_check(self, context):
+        wpt_scene_properties = context.scene.wpt_scene_properties
+        layout = self.layout
+
+        row = layout.row()
+        row.label(text="Check")
+
+        col = layout.column(align=True)
+        row = col.row(align=True)
+        row.prop(wpt_scene_properties, "clearance")
+        row = col.row(align=True)
+        row.operator(CheckInstances.bl_idname, icon='VIEWZOOM')
+
+        if wpt_scene_properties.overlap_count >= 0:
+            col = layout.column(align=True)
+            row = col.row(align=True)
+            row.alert = wpt_scene_properties.overlap_count > 0
+            row.label(text=pgettext("Overlaps") + ": " + str(wpt_scene_properties.overlap_count))
+            row = col.row(align=True)
+            row.alert = wpt_scene_properties.clearance_count > 0
+            row.label(text=pgettext("Too close") + ": " + str(wpt_scene_properties.clearance_count))
+
+        row = layout.row()
+        row.prop(wpt_scene_properties, "use_clearance_markers")
+
 class OBJECT_PT_wpt_collections(Panel):
     bl_space_type = 'PROPERTIES'
     bl_region_type = 'WINDOW'
@@ -307,6 +455,7 @@ class OBJECT_PT_wpt_collections(Panel):
                 layout.prop(collection, "name", text="")
                 wpt_collection_properties = collection.wpt_collection_properties
                 layout.prop(wpt_collection_properties, "export")
+                layout.prop(wpt_collection_properties, "weight")
 
 # op
 class AddCurveTool(Operator):
@@ -359,80 +508,118 @@ class AddCurveTool(Operator):
 class UpObject(Operator):
     bl_idname = "wpt.upobject"
     bl_label = "Up"
+    bl_options = {'REGISTER', 'UNDO'}
 
     def invoke(self, context, event):
-        slide = context.scene.wpt_scene_properties.slide
-        for obj in context.selected_objects:
-            obj.location[2] += slide
+        layering.move(context, context.scene.wpt_scene_properties.slide)
 
         return {'FINISHED'}
 
 class DownObject(Operator):
     bl_idname = "wpt.downobject"
     bl_label = "Down"
+    bl_options = {'REGISTER', 'UNDO'}
 
     def invoke(self, context, event):
-        slide = context.scene.wpt_scene_properties.slide
-        for obj in context.selected_objects:
-            obj.location[2] -= slide
+        layering.move(context, -context.scene.wpt_scene_properties.slide)
 
         return {'FINISHED'}
 
 class UpObjectSub(Operator):
     bl_idname = "wpt.upobject_sub"
     bl_label = "Up"
+    bl_options = {'REGISTER', 'UNDO'}
 
     def invoke(self, context, event):
-        slide = context.scene.wpt_scene_properties.slide_sub
-        for obj in context.selected_objects:
-            obj.location[2] += slide
+        layering.move(context, context.scene.wpt_scene_properties.slide_sub)
 
         return {'FINISHED'}
 
 class DownObjectSub(Operator):
     bl_idname = "wpt.downobject_sub"
     bl_label = "Down"
+    bl_options = {'REGISTER', 'UNDO'}
 
     def invoke(self, context, event):
-        slide = context.scene.wpt_scene_properties.slide_sub
-        for obj in context.selected_objects:
-            obj.location[2] -= slide
+        layering.move(context, -context.scene.wpt_scene_properties.slide_sub)
 
         return {'FINISHED'}
 
 class ResetObject(Operator):
     bl_idname = "wpt.resetobject"
     bl_label = "Reset"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def invoke(self, context, event):
+        layering.reset(context)
+
+        return {'FINISHED'}
+
+class FrontObject(Operator):
+    bl_idname = "wpt.frontobject"
+    bl_label = "Bring to Front"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def invoke(self, context, event):
+        layering.bring_to(context, True, context.scene.wpt_scene_properties.slide_sub)
+
+        return {'FINISHED'}
+
+class BackObject(Operator):
+    bl_idname = "wpt.backobject"
+    bl_label = "Send to Back"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def invoke(self, context, event):
+        layering.bring_to(context, False, context.scene.wpt_scene_properties.slide_sub)
+
+        return {'FINISHED'}
+
+class SwapObject(Operator):
+    bl_idname = "wpt.swapobject"
+    bl_label = "Swap"
+    bl_options = {'REGISTER', 'UNDO'}
 
     def invoke(self, context, event):
-        for obj in context.selected_objects:
-            obj.location[2] = 0.0
+        if layering.swap(context) <= 0:
+            self.report({'WARNING'}, "Select exactly two objects to swap")
+            return {'CANCELLED'}
+
+        return {'FINISHED'}
+
+class RenormalizeObject(Operator):
+    bl_idname = "wpt.renormalizeobject"
+    bl_label = "Renormalize"
+    bl_description = "Re-space z positions evenly while keeping the stacking order"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def invoke(self, context, event):
+        # 選択がなければ書き出し対象のコレクションすべてを並べ直す
+        collections = layering.get_collections(context.selected_objects)
+        if not collections:
+            collections = [collection for collection in bpy.data.collections if collection.wpt_collection_properties.export]
+
+        layering.renormalize(context, collections, context.scene.wpt_scene_properties.slide_sub)
 
         return {'FINISHED'}
 
 class UnrockObject(Operator):
     bl_idname = "wpt.unrockobject"
     bl_label = "Unrock"
+    bl_options = {'REGISTER', 'UNDO'}
 
     def invoke(self, context, event):
-        for obj in context.selected_objects:
-            obj.lock_location[0] = False
-            obj.lock_location[1] = False
-            obj.lock_scale[0] = False
-            obj.lock_scale[1] = False
+        layering.set_locks(context, False)
 
         return {'FINISHED'}
 
 class RockObject(Operator):
     bl_idname = "wpt.rockobject"
     bl_label = "Rock"
+    bl_options = {'REGISTER', 'UNDO'}
 
     def invoke(self, context, event):
-        for obj in context.selected_objects:
-            obj.lock_location[0] = True
-            obj.lock_location[1] = True
-            obj.lock_scale[0] = True
-            obj.lock_scale[1] = True
+        layering.set_locks(context, True)
 
         return {'FINISHED'}
 
@@ -553,6 +740,41 @@ translations = {
         ("*", "Yagasuri"): "矢絣",
         ("*", "Select All Collections"): "全てのコレクションを選択",
         ("*", "Deselect All Collections"): "全てのコレクションを解除",
+        ("*", "Weight"): "重み",
+        ("*", "Avoid same neighbors"): "隣接の重複を回避",
+        ("*", "Force Export"): "強制エクスポート",
+        ("*", "Standard"): "標準",
+        ("*", "Flattened"): "展開",
+        ("*", "Check"): "チェック",
+        ("*", "Check Overlaps"): "重なりをチェック",
+        ("*", "Clearance"): "最小間隔",
+        ("*", "Clearance markers"): "間隔マーカー",
+        ("*", "Overlaps"): "重なり",
+        ("*", "Too close"): "間隔不足",
+        ("*", "Keep clearance"): "間隔を保つ",
+        ("*", "Split into pages"): "ページに分割",
+        ("*", "Page width"): "ページ幅",
+        ("*", "Page height"): "ページ高さ",
+        ("*", "Overlap"): "重なり幅",
+        ("*", "Bleed"): "裁ち落とし",
+        ("*", "Page overlap must be at most half the page size"): "重なり幅はページの半分以下にしてください",
+        ("*", "Simplify curves"): "カーブを簡略化",
+        ("*", "Tolerance"): "許容誤差",
+        ("*", "Polylines"): "折れ線",
+        ("*", "Adaptive resolution"): "適応的な分割",
+        ("*", "Flatness"): "平坦度",
+        ("*", "Matrix transforms"): "行列で変換",
+        ("*", "Bring to Front"): "最前面へ",
+        ("*", "Send to Back"): "最背面へ",
+        ("*", "Swap"): "入れ替え",
+        ("*", "Renormalize"): "間隔を整える",
+        ("*", "Live export"): "自動エクスポート",
+        ("*", "Delay"): "待ち時間",
+        ("*", "Export Sequence"): "連番エクスポート",
+        ("*", "Frames"): "フレームごと",
+        ("*", "Placement manifest"): "配置の一覧",
+        ("*", "Proof"): "校正用",
+        ("*", "Proof density"): "校正用の解像度",
     }
 }
 
@@ -568,6 +790,10 @@ classes = (
     UpObjectSub,
     DownObjectSub,
     ResetObject,
+    FrontObject,
+    BackObject,
+    SwapObject,
+    RenormalizeObject,
     UnrockObject,
     RockObject,
     ApplyObject,
@@ -0,0 +1,142 @@
+import base64
+import hashlib
+import math
+import numpy
+import re
+import struct
+import zlib
+from . import geometry
+
+# 校正用にコレクションを CPU でラスタライズし、PNG の data URI にする
+
+# 画像の1辺の最大ピクセル数
+MAX_RASTER_SIZE = 2048
+# 1ピクセルあたりの縦横のサンプル数(アンチエイリアス)
+SUPERSAMPLING = 4
+# 一度に塗る出力の行数。巻き数のバッファをこの行数分に抑える
+BAND_ROWS = 16
+# 曲線を折れ線にするときの誤差(ラスタのピクセル単位)
+RASTER_FLATNESS = 0.25
+
+# key: コレクション名, value: (signature, rasterize の結果)
+_raster_cache = {}
+
+def parse_rgb(color):
+    # svgwrite.rgb() の 'rgb(r,g,b)' を 0-1 の値にする
+    return numpy.array([float(value) for value in re.findall(r"[\d.]+", color)[:3]], dtype=numpy.float32) / 255.0
+
+def fill_coverage(polygon, width, height, samples=SUPERSAMPLING):
+    # 閉じた多角形 (k, 2) を nonzero 規則で塗り、ピクセルごとの被覆率 (height, width) を返す
+    # 辺が横切るサンプル行ごとに、交点から右側の巻き数を足し込んでから行方向に累積する
+    p = polygon.astype(numpy.float64) * samples
+    x0, y0 = p[:, 0], p[:, 1]
+    x1, y1 = numpy.roll(x0, -1), numpy.roll(y0, -1)
+    sample_width = width * samples
+    sample_height = height * samples
+
+    # 中心 j + 0.5 が [min(y0, y1), max(y0, y1)) に入るサンプル行 j
+    first = numpy.clip(numpy.ceil(numpy.minimum(y0, y1) - 0.5), 0, sample_height).astype(numpy.int64)
+    last = numpy.clip(numpy.ceil(numpy.maximum(y0, y1) - 0.5), 0, sample_height).astype(numpy.int64)
+    counts = last - first
+
+    edges = numpy.repeat(numpy.arange(len(p)), counts)
+    rows = numpy.repeat(first, counts) + numpy.arange(len(edges)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    t = (rows + 0.5 - y0[edges]) / (y1[edges] - y0[edges])
+    columns = numpy.clip(numpy.ceil(x0[edges] + t * (x1[edges] - x0[edges]) - 0.5), 0, sample_width).astype(numpy.int64)
+    directions = numpy.where(y1[edges] > y0[edges], 1, -1).astype(numpy.int32)
+
+    order = numpy.argsort(rows, kind='stable')
+    rows = rows[order]
+    columns = columns[order]
+    directions = directions[order]
+
+    coverage = numpy.empty((height, width), dtype=numpy.float32)
+    band = BAND_ROWS * samples
+    starts = numpy.searchsorted(rows, numpy.arange(0, sample_height + band, band)).tolist()
+    for index, start in enumerate(range(0, sample_height, band)):
+        count = min(band, sample_height - start)
+        begin, end = starts[index], starts[index + 1]
+
+        winding = numpy.zeros((count, sample_width + 1), dtype=numpy.int32)
+        numpy.add.at(winding, (rows[begin:end] - start, columns[begin:end]), directions[begin:end])
+        inside = numpy.cumsum(winding[:, :sample_width], axis=1) != 0
+
+        coverage[start // samples:(start + count) // samples] = inside.reshape(count // samples, samples, width, samples).mean(axis=(1, 3))
+
+    return coverage
+
+def rasterize(shapes, density):
+    # shapes: (頂点列 (k, 2), 'rgb(r,g,b)', alpha) のリスト。描く順に重ねる
+    # density はシンボルの座標 1 あたりのピクセル数。(RGBA の画像, 左上, 大きさ) を返す
+    if not shapes:
+        return None
+
+    box_min, box_max = geometry.bounds(numpy.concatenate([polygon for polygon, color, alpha in shapes]).astype(numpy.float64))
+    # パスの stroke (幅 1) の分だけ広げる
+    box_min = box_min - 0.5
+    box_max = box_max + 0.5
+    size = box_max - box_min
+
+    density = min(density, MAX_RASTER_SIZE / float(size.max()))
+    width = max(1, math.ceil(size[0] * density))
+    height = max(1, math.ceil(size[1] * density))
+
+    # 乗算済みアルファで source-over 合成する
+    canvas = numpy.zeros((height, width, 4), dtype=numpy.float32)
+    for polygon, color, alpha in shapes:
+        coverage = fill_coverage((polygon - box_min) * density, width, height) * numpy.float32(alpha)
+        canvas *= (1.0 - coverage)[:, :, None]
+        canvas[:, :, :3] += coverage[:, :, None] * parse_rgb(color)
+        canvas[:, :, 3] += coverage
+
+    alpha = canvas[:, :, 3:]
+    rgb = numpy.divide(canvas[:, :, :3], alpha, out=numpy.zeros_like(canvas[:, :, :3]), where=alpha > 0.0)
+    image = numpy.concatenate((rgb, alpha), axis=2)
+    image = numpy.round(numpy.clip(image, 0.0, 1.0) * 255.0).astype(numpy.uint8)
+
+    return image, (float(box_min[0]), float(box_min[1])), (width / density, height / density)
+
+def encode_png(image):
+    # RGBA 8bit, フィルタなし
+    height, width = image.shape[:2]
+    raw = numpy.zeros((height, width * 4 + 1), dtype=numpy.uint8)
+    raw[:, 1:] = image.reshape(height, width * 4)
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    return (b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+        + chunk(b"IEND", b""))
+
+def get_polygons(svg_paths, density):
+    # SVGPath の制御点列を折れ線にする。折れ線で出力している場合はそのまま使う
+    shapes = []
+    for svg_path in svg_paths:
+        polygon = svg_path.points
+        if not svg_path.polyline:
+            polygon = geometry.flatten(polygon, flatness=RASTER_FLATNESS / density)
+        shapes.append((polygon, svg_path.color, svg_path.alpha))
+    return shapes
+
+def rasterize_cached(key, svg_paths, density):
+    # カーブの内容が変わっていなければ前回の画像を使う。(data URI, 左上, 大きさ) を返す
+    h = hashlib.sha1(repr(density).encode())
+    for svg_path in svg_paths:
+        h.update("{0}:{1}:{2}:".format(svg_path.color, svg_path.alpha, svg_path.polyline).encode())
+        h.update(svg_path.points.tobytes())
+    signature = h.hexdigest()
+
+    cached = _raster_cache.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    result = None
+    raster = rasterize(get_polygons(svg_paths, density), density)
+    if raster is not None:
+        image, origin, size = raster
+        result = ("data:image/png;base64," + base64.b64encode(encode_png(image)).decode("ascii"), origin, size)
+
+    _raster_cache[key] = (signature, result)
+    return result
@@ -0,0 +1,140 @@
+import collections
+import itertools
+import random
+
+# 正方格子の隣接セル(上下左右)
+SQUARE_NEIGHBORS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+# 六角格子の隣接セル。奇数行は半セルずれているので行の偶奇で分ける
+HEXAGONAL_NEIGHBORS_EVEN = ((-1, 0), (1, 0), (-1, -1), (0, -1), (-1, 1), (0, 1))
+HEXAGONAL_NEIGHBORS_ODD = ((-1, 0), (1, 0), (0, -1), (1, -1), (0, 1), (1, 1))
+
+class AliasTable():
+    # Vose のエイリアス法。1回の抽選は重みの数によらず O(1)
+    def __init__(self, weights):
+        n = len(weights)
+        total = float(sum(weights))
+        if total <= 0.0:
+            weights = [1.0] * n
+            total = float(n)
+
+        self.weights = list(weights)
+        self.prob = [0.0] * n
+        self.alias = list(range(n))
+
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+
+        for i in large + small:
+            self.prob[i] = 1.0
+
+    def __len__(self):
+        return len(self.prob)
+
+    def sample(self, rng=random):
+        # 重みが均等な場合は random.choice と同じ乱数列になる
+        i = rng.randrange(len(self.prob))
+        if self.prob[i] >= 1.0 or rng.random() < self.prob[i]:
+            return i
+        return self.alias[i]
+
+class CollectionPicker():
+    # 格子セルごとにコレクションを選ぶ。avoid_neighbors が有効なら隣接セルと同じものを避ける
+    def __init__(self, weights, pattern, avoid_neighbors=False, max_attempts=8, rng=random):
+        self.table = AliasTable(weights)
+        self.pattern = pattern
+        self.avoid_neighbors = avoid_neighbors
+        self.max_attempts = max_attempts
+        self.rng = rng
+        self.assigned = {}
+
+    def neighbor_offsets(self, cell):
+        if self.pattern == "1": # Hexagonal lattice
+            if cell[1] % 2 == 0:
+                return HEXAGONAL_NEIGHBORS_EVEN
+            return HEXAGONAL_NEIGHBORS_ODD
+        return SQUARE_NEIGHBORS
+
+    def pick(self, cell=None):
+        index = self.table.sample(self.rng)
+        if not self.avoid_neighbors or cell is None:
+            return index
+
+        used = set()
+        for dx, dy in self.neighbor_offsets(cell):
+            neighbor = self.assigned.get((cell[0] + dx, cell[1] + dy))
+            if neighbor is not None:
+                used.add(neighbor)
+
+        attempts = 1
+        while index in used and attempts < self.max_attempts:
+            index = self.table.sample(self.rng)
+            attempts += 1
+
+        if index in used:
+            # 重みの大きい候補が隣接で埋まっている場合は残りから重み付きで選ぶ
+            candidates = [i for i in range(len(self.table)) if i not in used and self.table.weights[i] > 0.0]
+            if candidates:
+                index = self.rng.choices(candidates, weights=[self.table.weights[i] for i in candidates])[0]
+
+        self.assigned[cell] = index
+        return index
+
+    def neighbors(self, cell):
+        for dx, dy in self.neighbor_offsets(cell):
+            neighbor = (cell[0] + dx, cell[1] + dy)
+            if neighbor in self.assigned:
+                yield neighbor
+
+    def count_conflicts(self, cell, index):
+        return sum(1 for neighbor in self.neighbors(cell) if self.assigned[neighbor] == index)
+
+    def lattice_class(self, cell):
+        # 隣接するセルが必ず違う値になる格子の塗り分け。六角格子は3色、正方格子は2色
+        x, y = cell
+        if self.pattern == "1": # Hexagonal lattice
+            return (x - (y - (y & 1)) // 2 - y) % 3
+        return (x + y) % 2
+
+    def repair(self):
+        # 1セルずつ選ぶと、隣接がすべての候補で埋まったセルに重複が残ることがある。
+        # これは候補の数が格子の塗り分けに必要な最小の色数(六角格子 3, 正方格子 2)と同じときだけ起こり、
+        # そのとき重複のない割り当ては格子の塗り分けの色を入れ替えたものに限られる。
+        # 今の割り当てと最も多く一致する入れ替えで塗り直し、変えたセルの {cell: index} を返す
+        changed = {}
+        if not self.avoid_neighbors or self.conflict_count() <= 0:
+            return changed
+
+        colors = 3 if self.pattern == "1" else 2
+        candidates = [i for i in range(len(self.table)) if self.table.weights[i] > 0.0]
+        if len(candidates) < colors:
+            # 塗り分けられない
+            return changed
+
+        matches = [collections.Counter() for color in range(colors)]
+        for cell, index in self.assigned.items():
+            matches[self.lattice_class(cell)][index] += 1
+        best = max(itertools.permutations(candidates, colors), key=lambda perm: sum(matches[color][perm[color]] for color in range(colors)))
+
+        for cell, index in self.assigned.items():
+            new_index = best[self.lattice_class(cell)]
+            if new_index != index:
+                changed[cell] = new_index
+        self.assigned.update(changed)
+
+        return changed
+
+    def conflict_count(self):
+        # 同じコレクションが隣り合っている組の数
+        return sum(self.count_conflicts(cell, index) for cell, index in self.assigned.items()) // 2
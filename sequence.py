@@ -0,0 +1,255 @@
+import bpy
+import collections
+import concurrent.futures
+import hashlib
+import logging
+import os
+from xml.sax.saxutils import escape
+from . import data_source
+from . import fingerprint
+from . import paging
+from . exporter import WrappingPaperMixin
+
+logger = logging.getLogger("wrapping_paper_tools")
+
+# パスのマークアップに影響するプロパティ
+PATH_PROPERTIES = ("scale", "use_simplify", "simplify_tolerance", "use_polyline", "use_adaptive_resolution", "flatness")
+ANIMATE_TEMPLATE = '<animate attributeName="display" values="{0}" keyTimes="{1}" dur="{2:.6g}s" calcMode="discrete" repeatCount="indefinite" />'
+
+class FrameBuilder(WrappingPaperMixin):
+    pass
+
+class SequenceCache():
+    # フレーム間で変わらなかったカーブのマークアップと配置を使い回す
+    def __init__(self, use_versions):
+        # SMIL では全フレームの定義を1つのファイルに置くので、形の変わったコレクションは id を分けて残す
+        self.use_versions = use_versions
+        # obj.name -> (key, マークアップ, SVGPath のリスト)
+        self.objects = {}
+        # (collection.name, オブジェクトの key のタプル) -> (id, マークアップ, SVGPath のリスト)
+        self.groups = {}
+        self.group_counts = {}
+        self.defs = []
+        self.def_ids = set()
+        self.proof_defs = []
+        self.instances_key = None
+        self.instances = None
+
+        self.curve_count = 0
+        self.placement_count = 0
+
+    def get_object(self, builder, obj, settings):
+        h = hashlib.sha1(settings)
+        fingerprint.update_object(h, obj)
+        key = h.hexdigest()
+
+        cached = self.objects.get(obj.name)
+        if cached is not None and cached[0] == key:
+            return cached
+
+        group = builder.svg.g()
+        paths = []
+        builder.add_curve_data(obj, group, paths)
+        cached = (key, ''.join(element.tostring() for element in group.elements), paths)
+        self.objects[obj.name] = cached
+        self.curve_count += 1
+
+        return cached
+
+    def get_group(self, builder, collection, settings, use_defs):
+        # z位置が小さい順は create_group と同じ
+        entries = [self.get_object(builder, obj, settings) for obj in sorted(collection.objects, key=lambda obj: obj.location.z)]
+        group_key = (collection.name, tuple(entry[0] for entry in entries))
+
+        group = self.groups.get(group_key)
+        if group is not None:
+            return group_key, group
+
+        count = self.group_counts.get(collection.name, 0)
+        group_id = collection.name
+        if self.use_versions and count > 0:
+            group_id = "{0}-{1}".format(collection.name, count)
+        elif not self.use_versions:
+            # 前のフレームの版はもう使わない
+            for key in [key for key in self.groups if key[0] == collection.name]:
+                del self.groups[key]
+
+        markup = '<g id="{0}">{1}</g>'.format(escape(group_id, {'"': '&quot;'}), ''.join(entry[1] for entry in entries))
+        group = (group_id, markup, [path for entry in entries for path in entry[2]])
+        self.groups[group_key] = group
+        self.group_counts[collection.name] = count + 1
+        # Flattened, Proof ではベクターの定義は参照されないので置かない
+        if self.use_versions and use_defs:
+            self.defs.append(markup)
+
+        return group_key, group
+
+    def build(self, context):
+        # 現在のフレームの (コレクションの <g> のリスト, 背景, インスタンス) を返す
+        scene = context.scene
+        wpt_scene_properties = scene.wpt_scene_properties
+
+        builder = FrameBuilder()
+        builder.get_objects()
+        builder.create_drawing(context, None)
+        background = builder.get_background_markup()
+
+        settings = repr([getattr(wpt_scene_properties, name) for name in PATH_PROPERTIES]).encode()
+        use_defs = wpt_scene_properties.export_mode == "0"
+        group_keys = []
+        groups = []
+        for collection in builder.collections:
+            group_key, (group_id, markup, paths) = self.get_group(builder, collection, settings, use_defs)
+            builder.ids[collection.name] = group_id
+            builder.paths[collection.name] = paths
+            group_keys.append(group_key)
+            groups.append(markup)
+
+        # 配置はシーンとコレクションの設定だけで決まる。外接矩形やパスを使う場合はコレクションの形にも依存する
+        h = hashlib.sha1()
+        fingerprint.update_properties(h, wpt_scene_properties, fingerprint.IGNORED_SCENE_PROPERTIES)
+        for collection in builder.collections:
+            h.update("collection:{0}:{1}".format(collection.name, builder.get_id(collection)).encode("utf-8"))
+            fingerprint.update_properties(h, collection.wpt_collection_properties, {"rna_type"})
+        if wpt_scene_properties.pattern_type == "3": # Circle packing
+            h.update(repr(data_source.get_signature(wpt_scene_properties.circles_data_path, "circles_data.csv")).encode())
+        if wpt_scene_properties.export_mode != "0" or wpt_scene_properties.use_clearance_noise:
+            h.update(repr(group_keys).encode("utf-8"))
+        instances_key = h.hexdigest()
+
+        if instances_key != self.instances_key:
+            builder.create_points(wpt_scene_properties.width, wpt_scene_properties.height)
+            builder.create_uses()
+            self.instances = ''.join(builder.get_instance_markup())
+            # Proof の画像。SMIL では同じ id の定義を重ねて置かない
+            self.proof_defs = []
+            for element in builder.svg.defs.elements:
+                markup = element.tostring()
+                self.proof_defs.append(markup)
+                if self.use_versions and element['id'] not in self.def_ids:
+                    self.def_ids.add(element['id'])
+                    self.defs.append(markup)
+            self.instances_key = instances_key
+            self.placement_count += 1
+
+        if wpt_scene_properties.export_mode == "2": # Proof
+            groups = self.proof_defs
+        elif not use_defs: # Flattened
+            groups = []
+
+        return groups, background, self.instances
+
+class SequenceExporter(bpy.types.Operator):
+    bl_idname = "wpt.sequence_exporter"
+    bl_label = "Export Sequence"
+    bl_description = "Export the scene frame range as one SVG per frame or as a single SMIL animation"
+
+    def invoke(self, context, event):
+        return self.execute(context)
+
+    def execute(self, context):
+        try:
+            return self.export(context)
+        except (OSError, ValueError) as error:
+            # 外部データが見つからない、読めない場合
+            message = data_source.get_error_message(error)
+            logger.error(message)
+            self.report({'ERROR'}, message)
+            return {'CANCELLED'}
+
+    def export(self, context):
+        logger.info("start")
+
+        scene = context.scene
+        wpt_scene_properties = scene.wpt_scene_properties
+        export_path = bpy.path.abspath(wpt_scene_properties.export_path)
+        use_smil = wpt_scene_properties.sequence_format == "1"
+        frames = list(range(scene.frame_start, scene.frame_end + 1, max(1, scene.frame_step)))
+
+        cache = SequenceCache(use_smil)
+        frame_current = scene.frame_current
+        # SMIL では同じ内容が続くフレームを1つにまとめる: [開始番号, フレーム数, 背景, インスタンス]
+        spans = []
+        max_workers = min(8, os.cpu_count() or 1)
+        pending = collections.deque()
+        paths = []
+
+        # bpy はメインスレッドでしか触れないので、フレームの組み立ては順に行い書き込みだけをワーカーに渡す
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            try:
+                for index, frame in enumerate(frames):
+                    scene.frame_set(frame)
+                    groups, background, instances = cache.build(context)
+
+                    if use_smil:
+                        if spans and spans[-1][2] == background and spans[-1][3] is instances:
+                            spans[-1][1] += 1
+                        else:
+                            spans.append([index, 1, background, instances])
+                        continue
+
+                    width = wpt_scene_properties.width
+                    height = wpt_scene_properties.height
+                    parts = ["<defs>"] + groups + ["</defs>", background, instances] if groups else [background, instances]
+                    pending.append(executor.submit(paging.write_page, get_frame_path(export_path, frame), (-width/2, -height/2), (width/2, height/2), parts))
+
+                    # 書き込みが追いつかないときは待って、メモリに残るフレームを抑える
+                    while len(pending) > max_workers * 2:
+                        paths.append(pending.popleft().result())
+            finally:
+                scene.frame_set(frame_current)
+
+            while pending:
+                paths.append(pending.popleft().result())
+
+        if use_smil and spans:
+            fps = scene.render.fps / scene.render.fps_base
+            duration = len(frames) * max(1, scene.frame_step) / fps
+            width = wpt_scene_properties.width
+            height = wpt_scene_properties.height
+            parts = ["<defs>"] + cache.defs + ["</defs>"] if cache.defs else []
+            for start, count, background, instances in spans:
+                parts.append(get_frame_group(start, count, len(frames), duration))
+                parts.append(background)
+                parts.append(instances)
+                parts.append("</g>")
+            paths.append(paging.write_page(get_animation_path(export_path), (-width/2, -height/2), (width/2, height/2), parts))
+
+        logger.info("end: {0} frames, {1} curves serialized, {2} placements".format(len(frames), cache.curve_count, cache.placement_count))
+        self.report({'INFO'}, "{0} frames exported, {1} curves serialized".format(len(frames), cache.curve_count))
+
+        return {'FINISHED'}
+
+def get_frame_path(export_path, frame):
+    stem, extension = os.path.splitext(export_path)
+    return "{0}_{1:04d}{2}".format(stem, frame, extension or ".svg")
+
+def get_animation_path(export_path):
+    stem, extension = os.path.splitext(export_path)
+    return "{0}_anim{1}".format(stem, extension or ".svg")
+
+def get_frame_group(start, count, total, duration):
+    # start から count フレームの間だけ表示する <g> の開始タグ。SMIL 非対応の環境では最初のフレームが見える
+    begin = start / total
+    end = (start + count) / total
+    if start == 0 and count == total:
+        return "<g>"
+    if start == 0:
+        return "<g>" + ANIMATE_TEMPLATE.format("inline;none", "0;{0:.6g}".format(end), duration)
+    if start + count == total:
+        return '<g display="none">' + ANIMATE_TEMPLATE.format("none;inline", "0;{0:.6g}".format(begin), duration)
+    return '<g display="none">' + ANIMATE_TEMPLATE.format("none;inline;none", "0;{0:.6g};{1:.6g}".format(begin, end), duration)
+
+classes = (
+    SequenceExporter,
+)
+
+def register():
+    from bpy.utils import register_class
+    for cls in classes:
+        register_class(cls)
+
+def unregister():
+    from bpy.utils import unregister_class
+    for cls in classes:
+        unregister_class(cls)
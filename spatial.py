@@ -0,0 +1,168 @@
+import math
+import numpy
+import random
+
+# 一様グリッドのセルの大きさにする矩形の大きさの分位点。これより大きい矩形は複数のセルに登録する
+CELL_SIZE_PERCENTILE = 75
+# 位置ノイズで調べる隣接セル
+NEIGHBOR_OFFSETS = tuple((dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1))
+
+def instance_bounds(placements, collection_bounds):
+    # collection_bounds[i] はコレクション i のローカルな外接矩形 (min, max)。配置後の外接矩形を (n, 2) の min, max で返す
+    count = len(placements)
+    mins = numpy.zeros((count, 2), dtype=numpy.float64)
+    maxs = numpy.zeros((count, 2), dtype=numpy.float64)
+
+    for collection_index, bounds in enumerate(collection_bounds):
+        indices = numpy.nonzero(placements.collection == collection_index)[0]
+        if len(indices) <= 0:
+            continue
+
+        if bounds is None:
+            mins[indices] = numpy.stack((placements.x[indices], placements.y[indices]), axis=1)
+            maxs[indices] = mins[indices]
+            continue
+
+        (min_x, min_y), (max_x, max_y) = bounds
+        corners = numpy.array(((min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y)), dtype=numpy.float64)
+        matrices = placements.matrices(indices)
+        transformed = numpy.einsum('kij,nj->kni', matrices[:, :, :2], corners) + matrices[:, None, :, 2]
+        mins[indices] = transformed.min(axis=1)
+        maxs[indices] = transformed.max(axis=1)
+
+    return mins, maxs
+
+def separation(mins, maxs, i, j):
+    # 矩形どうしの距離。重なっている場合は負の値(重なりの浅い軸の深さ)
+    sep = numpy.maximum(mins[j] - maxs[i], mins[i] - maxs[j])
+    outside = numpy.maximum(sep, 0.0)
+    gap = numpy.hypot(outside[:, 0], outside[:, 1])
+    overlap = (sep[:, 0] < 0.0) & (sep[:, 1] < 0.0)
+    gap[overlap] = numpy.maximum(sep[overlap, 0], sep[overlap, 1])
+    return gap
+
+class UniformGrid():
+    # 矩形を、margin だけ広げた範囲が重なるすべてのセルに登録する一様グリッド
+    # セルの大きさは典型的な矩形に合わせるので、大きな矩形が混じっても少数のセルに集まらない
+    def __init__(self, mins, maxs, margin=0.0):
+        self.mins = mins
+        self.maxs = maxs
+
+        extent = 0.0
+        if len(mins) > 0:
+            extent = float(numpy.percentile((maxs - mins).max(axis=1), CELL_SIZE_PERCENTILE))
+        self.cell_size = extent + margin if extent + margin > 0.0 else 1.0
+
+        first = numpy.floor(mins / self.cell_size).astype(numpy.int64)
+        last = numpy.floor((maxs + margin) / self.cell_size).astype(numpy.int64)
+        span = last - first + 1
+        counts = span[:, 0] * span[:, 1]
+
+        index = numpy.repeat(numpy.arange(len(mins)), counts)
+        local = numpy.arange(len(index)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        cx = first[index, 0] + local % span[index, 0]
+        cy = first[index, 1] + local // span[index, 0]
+
+        keys = self.make_keys(cx, cy)
+        # 同じセルの中では矩形の番号順になる
+        order = numpy.argsort(keys, kind='stable')
+        self.entry_keys = keys[order]
+        self.entry_index = index[order]
+
+    def make_keys(self, cx, cy):
+        # 2つのセル座標を1つの整数キーにまとめる
+        return (cx << 32) ^ (cy & 0xffffffff)
+
+    def candidate_pairs(self):
+        # 同じセルにある矩形の組 (i, j), i < j を重複なくまとめて返す
+        keys = self.entry_keys
+        count = len(keys)
+        ends = numpy.searchsorted(keys, keys, side='right')
+        counts = ends - numpy.arange(count) - 1
+        total = int(counts.sum())
+        if total == 0:
+            empty = numpy.empty(0, dtype=numpy.int64)
+            return empty, empty
+
+        # 各項目を同じセルの後ろの項目すべてと組にする
+        a = numpy.repeat(numpy.arange(count), counts)
+        b = a + 1 + numpy.arange(total) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        i = self.entry_index[a]
+        j = self.entry_index[b]
+
+        # 2つの範囲の共通部分の左下隅が入るセルでだけ数え、複数のセルで重ならないようにする
+        reference = numpy.floor(numpy.maximum(self.mins[i], self.mins[j]) / self.cell_size).astype(numpy.int64)
+        keep = self.make_keys(reference[:, 0], reference[:, 1]) == keys[a]
+        return i[keep], j[keep]
+
+    def query(self, min_xy, max_xy):
+        # 矩形と交差する登録済み矩形の番号(昇順)
+        min_xy = numpy.asarray(min_xy, dtype=numpy.float64)
+        max_xy = numpy.asarray(max_xy, dtype=numpy.float64)
+        first = numpy.floor(min_xy / self.cell_size).astype(numpy.int64)
+        last = numpy.floor(max_xy / self.cell_size).astype(numpy.int64)
+        span = last - first + 1
+
+        if span[0] * span[1] > len(self.entry_keys):
+            # セルを引くより全部を調べるほうが早い
+            result = numpy.arange(len(self.mins))
+        else:
+            cx, cy = numpy.meshgrid(numpy.arange(first[0], last[0] + 1), numpy.arange(first[1], last[1] + 1))
+            keys = self.make_keys(cx.ravel(), cy.ravel())
+            lo = numpy.searchsorted(self.entry_keys, keys, side='left')
+            hi = numpy.searchsorted(self.entry_keys, keys, side='right')
+            counts = hi - lo
+            positions = numpy.repeat(lo - numpy.cumsum(counts) + counts, counts) + numpy.arange(int(counts.sum()))
+            result = numpy.unique(self.entry_index[positions])
+
+        hit = numpy.all(self.mins[result] <= max_xy, axis=1) & numpy.all(self.maxs[result] >= min_xy, axis=1)
+        return result[hit]
+
+def find_close_pairs(mins, maxs, clearance):
+    # 重なっている組と、間隔が clearance 未満の組を (i, j, gap) で返す。gap が負なら重なり
+    if len(mins) < 2:
+        empty = numpy.empty(0, dtype=numpy.int64)
+        return empty, empty, numpy.empty(0, dtype=numpy.float64)
+
+    grid = UniformGrid(mins, maxs, clearance)
+    i, j = grid.candidate_pairs()
+    gap = separation(mins, maxs, i, j)
+
+    close = gap < clearance
+    return i[close], j[close], gap[close]
+
+def jitter_with_clearance(bases, half_extent, clearance, noise_limit, rng=random, max_attempts=8):
+    # 各点に位置ノイズを加える。近傍の点(未処理の点は元の位置)との間隔が clearance 未満になるノイズは棄却し、
+    # 棄却が続くとノイズの幅を半分にしていく。最後まで見つからなければ元の位置のままにする
+    half_x, half_y = half_extent
+    cell_size = max(2.0 * max(half_x, half_y) + clearance + 2.0 * noise_limit, 1e-9)
+
+    grid = {}
+    for index, (x, y) in enumerate(bases):
+        grid.setdefault((math.floor(x / cell_size), math.floor(y / cell_size)), []).append(index)
+
+    positions = [tuple(base) for base in bases]
+    for index, (base_x, base_y) in enumerate(bases):
+        cell_x = math.floor(base_x / cell_size)
+        cell_y = math.floor(base_y / cell_size)
+        neighbors = [positions[j] for dx, dy in NEIGHBOR_OFFSETS for j in grid.get((cell_x + dx, cell_y + dy), ()) if j != index]
+
+        limit = noise_limit
+        for attempt in range(max_attempts):
+            x = base_x + rng.uniform(-limit, limit)
+            y = base_y + rng.uniform(-limit, limit)
+            if all(box_gap(x, y, other_x, other_y, half_x, half_y) >= clearance for other_x, other_y in neighbors):
+                positions[index] = (x, y)
+                break
+            if attempt % 2 == 1:
+                limit *= 0.5
+
+    return positions
+
+def box_gap(x0, y0, x1, y1, half_x, half_y):
+    # 同じ大きさの矩形どうしの距離。重なっている場合は負の値
+    sep_x = abs(x0 - x1) - 2.0 * half_x
+    sep_y = abs(y0 - y1) - 2.0 * half_y
+    if sep_x > 0.0 and sep_y > 0.0:
+        return math.hypot(sep_x, sep_y)
+    return max(sep_x, sep_y)